@@ -0,0 +1,81 @@
+import argparse
+import copy
+import filecmp
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from json2cameo import JsonToCameo, read_json_file  # noqa: E402
+from scripts.batch import BatchBuild  # noqa: E402
+
+SAMPLE = os.path.join(ROOT, 'sample_data', 'shr_spec.json')
+
+
+# Spec variants that each change the description of one namespace, so
+# they share every other namespace and all of their value sets
+def make_variants(spec: dict, count: int, directory: str) -> list:
+  filenames = []
+  for i in range(count):
+    variant = copy.deepcopy(spec)
+    for section in variant.get('children', []):
+      if section.get('type') == 'Namespaces':
+        children = section.get('children', [])
+        namespace = children[i % len(children)]
+        namespace['description'] = '{0} (variant {1})'.format(
+            namespace.get('description', ''), i)
+    filename = os.path.join(directory, 'variant{0}.json'.format(i))
+    with open(filename, 'w') as spec_file:
+      json.dump(variant, spec_file)
+    filenames.append(filename)
+  return filenames
+
+
+# True when every file of two output directories is the same
+def same_output(a: str, b: str) -> bool:
+  names = sorted(os.listdir(a))
+  if names != sorted(os.listdir(b)):
+    return False
+  match, mismatch, errors = filecmp.cmpfiles(a, b, names, shallow=False)
+  return not mismatch and not errors
+
+
+def main(args):
+  parser = argparse.ArgumentParser(description='Batch conversion benchmark')
+  parser.add_argument('filename', nargs='?', default=SAMPLE)
+  parser.add_argument('--specs', type=int, default=20,
+                      help='number of spec variants')
+  parser.add_argument('-j', '--jobs', type=int, default=4)
+  options = parser.parse_args(args)
+  spec = read_json_file(options.filename)
+  with tempfile.TemporaryDirectory() as directory:
+    filenames = make_variants(spec, options.specs, directory)
+    start = time.perf_counter()
+    for filename in filenames:
+      name = os.path.basename(filename).rpartition('.')[0]
+      output = os.path.join(directory, 'single', name)
+      JsonToCameo(filename=filename, output=output).all_files()
+    single = time.perf_counter() - start
+    results = [('one at a time', single, True)]
+    for jobs in (0, options.jobs):
+      output = os.path.join(directory, 'batch{0}'.format(jobs))
+      start = time.perf_counter()
+      BatchBuild(filenames, output, jobs).run()
+      seconds = time.perf_counter() - start
+      same = all(same_output(os.path.join(directory, 'single', i),
+                             os.path.join(output, i))
+                 for i in os.listdir(output))
+      results.append(('batch -j {0}'.format(jobs), seconds, same))
+  print('{0} specs'.format(options.specs))
+  for name, seconds, same in results:
+    text = '  {0:16}{1:>8.3f} s{2:>8.1f}x  {3}'
+    print(text.format(name, seconds, single / seconds,
+                      'same output' if same else 'DIFFERENT OUTPUT'))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from json2cameo import read_json_file  # noqa: E402
+from scripts.constraints import Constraints  # noqa: E402
+
+SAMPLE = os.path.join(ROOT, 'sample_data', 'shr_spec.json')
+
+
+# Collects (constraints, label) pairs the way the models construct them
+def collect_constraints(spec: dict) -> list:
+  found = []
+  values = []
+  for section in spec.get('children', []):
+    if section.get('type') != 'Namespaces':
+      continue
+    for ns in section.get('children', []):
+      for element in ns.get('children', []):
+        values.append(element.get('value', {}))
+        values.extend(element.get('children', []))
+  for value in values:
+    options = [value] + list(value.get('value', [])) if value else []
+    for option in options:
+      constraints = option.get('constraints', [])
+      if constraints:
+        label = option.get('identifier', {}).get('label', '')
+        found.append((constraints, label))
+  return found
+
+
+def render_all(found: list) -> None:
+  for constraints, label in found:
+    str(Constraints(constraints, label))
+
+
+def main(args):
+  parser = argparse.ArgumentParser(description='Constraint render benchmark')
+  parser.add_argument('filename', nargs='?', default=SAMPLE)
+  parser.add_argument('-n', '--number', type=int, default=20)
+  options = parser.parse_args(args)
+  found = collect_constraints(read_json_file(options.filename))
+  times = timeit.repeat(lambda: render_all(found), number=options.number,
+                        repeat=5)
+  best = min(times) / options.number
+  print('{0:30}{1:>10}'.format('constraint lists', len(found)))
+  print('{0:30}{1:>10.1f} us'.format('per render', best / len(found) * 1e6))
+  print('{0:30}{1:>10.0f}'.format('renders per second', len(found) / best))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
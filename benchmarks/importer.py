@@ -0,0 +1,75 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.pipeline import scale_spec  # noqa: E402
+from json2cameo import JsonToCameo, read_json_file  # noqa: E402
+from scripts.importer import CameoImporter  # noqa: E402
+from scripts.output import FileOutput, MemoryOutput  # noqa: E402
+
+SAMPLE = os.path.join(ROOT, 'sample_data', 'shr_spec.json')
+
+
+# Uses and CodeSystem lines come from sets and dicts, so their order isn't
+# part of the round trip
+def normalize(text: str) -> list:
+  lines = text.split('\n')
+  for i, line in enumerate(lines):
+    if line.startswith('Uses:'):
+      lines[i] = ', '.join(sorted(line[20:].split(', ')))
+  return sorted(i for i in lines if i.startswith('CodeSystem:')) + [
+      i for i in lines if not i.startswith('CodeSystem:')]
+
+
+# Imports a directory of Cameo files, then converts the json back and
+# counts the files that come out the same
+def benchmark(directory: str) -> dict:
+  names = sorted(i for i in os.listdir(directory) if i.endswith('.txt'))
+  size = sum(os.path.getsize(os.path.join(directory, i)) for i in names)
+  start = time.perf_counter()
+  importer = CameoImporter()
+  importer.read_path(directory)
+  spec = importer.to_json()
+  seconds = time.perf_counter() - start
+  memory = MemoryOutput()
+  JsonToCameo(json_data=spec, backend=memory,
+              codesystems=importer.codesystems).all_files()
+  same = 0
+  for name in names:
+    with open(os.path.join(directory, name), 'r') as cameo_file:
+      text = cameo_file.read()
+    if name in memory.files and normalize(text) == normalize(
+        memory.files[name]):
+      same += 1
+  return {'files': len(names), 'bytes': size, 'seconds': seconds,
+          'round_trip': same, 'ambiguous': len(importer.ambiguous)}
+
+
+def main(args):
+  parser = argparse.ArgumentParser(description='Cameo import benchmarks')
+  parser.add_argument('filename', nargs='?', default=SAMPLE)
+  parser.add_argument('--scales', default='1,10',
+                      help='comma separated spec scale factors')
+  options = parser.parse_args(args)
+  spec = read_json_file(options.filename)
+  for scale in [int(i) for i in options.scales.split(',')]:
+    with tempfile.TemporaryDirectory() as directory:
+      JsonToCameo(json_data=scale_spec(spec, scale),
+                  backend=FileOutput(directory)).all_files()
+      results = benchmark(directory)
+    rate = results['bytes'] / results['seconds'] / (1 << 20)
+    text = ('x{0:<5}{1:>6} files{2:>10.3f} s{3:>8.1f} MiB/s{4:>8} round trip'
+            '{5:>6} ambiguous')
+    print(text.format(scale, results['files'], results['seconds'], rate,
+                      '{0}/{1}'.format(results['round_trip'],
+                                       results['files']),
+                      results['ambiguous']))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,158 @@
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.pipeline import scale_spec  # noqa: E402
+from json2cameo import read_json_file  # noqa: E402
+from scripts import namespace, symbols, value_sets  # noqa: E402
+
+SAMPLE = os.path.join(ROOT, 'sample_data', 'shr_spec.json')
+
+
+# Splits the spec into its Namespaces and ValueSets sections
+def get_sections(spec: dict) -> tuple:
+  sections = {i.get('type'): i for i in spec.get('children', [])}
+  return sections['Namespaces'], sections['ValueSets']
+
+
+# Builds and renders every namespace and value set
+def convert(n: dict, v: dict) -> None:
+  namespaces = namespace.Namespaces(n)
+  vs = value_sets.ValueSets(v)
+  for i in namespaces.namespaces:
+    str(namespaces.namespaces[i])
+  for i in vs.value_sets:
+    str(vs.value_sets[i])
+
+
+# Size of an instance including its __dict__ when it has one
+def instance_size(obj) -> int:
+  size = sys.getsizeof(obj)
+  if hasattr(obj, '__dict__'):
+    size += sys.getsizeof(obj.__dict__)
+  return size
+
+
+# Finds the first spec child of each model type to measure instances with
+def sample_children(n: dict, v: dict) -> dict:
+  found = dict()
+  for ns in n.get('children', []):
+    for element in ns.get('children', []):
+      for child in element.get('children', []):
+        found.setdefault(child.get('type'), child)
+  for vs in v.get('children', []):
+    for child in vs.get('children', []):
+      found.setdefault('Value', child)
+  return found
+
+
+def report_instances(n: dict, v: dict) -> None:
+  children = sample_children(n, v)
+  models = [
+      ('IdentifiableValue', namespace.IdentifiableValue),
+      ('TBD', namespace.ChildTBD),
+      ('Incomplete', namespace.Incomplete),
+      ('ChoiceValue', namespace.ChoiceValue),
+      ('Value', value_sets.Value)
+  ]
+  for c_type, cls in models:
+    if c_type in children:
+      size = instance_size(cls(children[c_type]))
+      print('{0:30}{1:>10} bytes'.format(cls.__name__, size))
+
+
+# Runs a stage in a fresh process so earlier allocations in this one don't
+# hide its numbers. Returns the peak RSS in KiB of loading, and optionally
+# converting, the spec, or the bytes retained models use.
+def measure(filename: str, stage: str) -> int:
+  command = [sys.executable, os.path.abspath(__file__), filename, '--stage',
+             stage]
+  return int(subprocess.check_output(command, cwd=ROOT))
+
+
+# Bytes the built models keep once the spec json is released, traced from
+# before decoding so json strings the models hold on to are counted
+def retained_memory(filename: str) -> int:
+  with open(filename, 'rb') as spec_file:
+    data = spec_file.read()
+  gc.collect()
+  tracemalloc.start()
+  n, v = get_sections(json.loads(data))
+  models = (namespace.Namespaces(n), value_sets.ValueSets(v))
+  del n, v
+  gc.collect()
+  retained = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  del models
+  return retained
+
+
+def run_stage(filename: str, stage: str) -> None:
+  if stage in ('retained', 'uninterned'):
+    if stage == 'uninterned':
+      symbols.disable()
+    print(retained_memory(filename))
+    return
+  n, v = get_sections(read_json_file(filename))
+  if stage == 'convert':
+    convert(n, v)
+  print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def main(args):
+  parser = argparse.ArgumentParser(description='Model memory benchmark')
+  parser.add_argument('filename', nargs='?', default=SAMPLE)
+  parser.add_argument('--scale', type=int, default=1,
+                      help='repeat every namespace and value set this often')
+  parser.add_argument('--stage', choices=['load', 'convert', 'retained',
+                                          'uninterned'],
+                      help=argparse.SUPPRESS)
+  options = parser.parse_args(args)
+  if options.stage:
+    return run_stage(options.filename, options.stage)
+  if options.scale > 1:
+    with tempfile.TemporaryDirectory() as directory:
+      spec = scale_spec(read_json_file(options.filename), options.scale)
+      filename = os.path.join(directory, 'scaled.json')
+      with open(filename, 'w') as spec_file:
+        json.dump(spec, spec_file)
+      return report(filename)
+  report(options.filename)
+
+
+def report(filename: str) -> None:
+  load_rss = measure(filename, 'load')
+  convert_rss = measure(filename, 'convert')
+  # Interning is compared in fresh processes, as strings interned by an
+  # earlier run would already be shared
+  retained = measure(filename, 'retained')
+  uninterned = measure(filename, 'uninterned')
+  n, v = get_sections(read_json_file(filename))
+  gc.collect()
+  tracemalloc.start()
+  convert(n, v)
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  print('{0:30}{1:>10} KiB'.format('peak RSS after load', load_rss))
+  print('{0:30}{1:>10} KiB'.format('peak RSS after convert', convert_rss))
+  print('{0:30}{1:>10} KiB'.format('traced conversion peak', peak // 1024))
+  print('{0:30}{1:>10} KiB'.format('models without interning',
+                                   uninterned // 1024))
+  print('{0:30}{1:>10} KiB'.format('models with interning', retained // 1024))
+  print('{0:30}{1:>10.1f} %'.format('saved by interning',
+                                    100 * (1 - retained / uninterned)))
+  report_instances(n, v)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,148 @@
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from json2cameo import read_json_file  # noqa: E402
+from scripts.codesystems import CodeSystems  # noqa: E402
+from scripts.decoders import NAMES, get_decoder  # noqa: E402
+from scripts.namespace import Namespaces  # noqa: E402
+from scripts.value_sets import ValueSets  # noqa: E402
+
+SAMPLE = os.path.join(ROOT, 'sample_data', 'shr_spec.json')
+STAGES = ['json load', 'namespaces', 'value sets', 'render', 'write']
+
+
+# Replaces every string naming one of the namespaces with its renamed copy
+def rename(data, names: dict):
+  if isinstance(data, dict):
+    return {k: rename(data[k], names) for k in data}
+  elif isinstance(data, list):
+    return [rename(i, names) for i in data]
+  elif isinstance(data, str):
+    return names.get(data, data)
+  return data
+
+
+# Builds a spec with every namespace and value set repeated scale times,
+# each copy renamed so namespaces stay distinct but keep their references
+def scale_spec(spec: dict, scale: int) -> dict:
+  scaled = copy.deepcopy(spec)
+  for section in scaled.get('children', []):
+    if section.get('type') not in ('Namespaces', 'ValueSets'):
+      continue
+    originals = section.get('children', [])
+    labels = set(i.get('label') for i in originals if i.get('label'))
+    labels.update(i.get('namespace') for i in originals if i.get('namespace'))
+    children = list(originals)
+    for copy_index in range(1, scale):
+      names = {i: '{0}{1}'.format(i, copy_index) for i in labels}
+      children.extend(rename(i, names) for i in originals)
+    section['children'] = children
+  return scaled
+
+
+# Runs each conversion stage, recording wall time or traced peak memory
+def run_pipeline(filename: str, output: str, trace: bool,
+                 decoder: str=None) -> dict:
+  results = dict()
+
+  @contextmanager
+  def stage(name):
+    if trace:
+      tracemalloc.reset_peak()
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    if trace:
+      results[name] = tracemalloc.get_traced_memory()[1]
+    else:
+      results[name] = elapsed
+
+  with stage('json load'):
+    spec = read_json_file(filename, decoder)
+  sections = {i.get('type'): i for i in spec.get('children', [])}
+  with stage('namespaces'):
+    namespaces = Namespaces(sections['Namespaces']).namespaces
+  with stage('value sets'):
+    value_sets = ValueSets(sections['ValueSets']).value_sets
+  with stage('render'):
+    files = dict()
+    for i in value_sets:
+      files['{0}_vs.txt'.format(i.replace('.', '_'))] = str(value_sets[i])
+    for i in namespaces:
+      files['{0}.txt'.format(i.replace('.', '_'))] = str(namespaces[i])
+  with stage('write'):
+    for name in files:
+      with open(os.path.join(output, name), 'w') as outfile:
+        outfile.write(files[name])
+  return results
+
+
+# Times a spec, then measures per stage memory in a second traced pass so
+# tracing overhead doesn't distort the timings
+def benchmark(filename: str, decoder: str=None) -> dict:
+  state = CodeSystems.get_state()
+  with tempfile.TemporaryDirectory() as output:
+    timings = run_pipeline(filename, output, False, decoder)
+    CodeSystems.set_state(state)
+    tracemalloc.start()
+    memory = run_pipeline(filename, output, True, decoder)
+    tracemalloc.stop()
+    CodeSystems.set_state(state)
+  return {i: {'seconds': timings[i], 'peak_bytes': memory[i]} for i in STAGES}
+
+
+def print_results(name: str, results: dict) -> None:
+  print(name)
+  total = 0
+  for i in STAGES:
+    total += results[i]['seconds']
+    peak = results[i]['peak_bytes'] / (1 << 20)
+    text = '  {0:14}{1:>10.3f} s{2:>12.1f} MiB'
+    print(text.format(i, results[i]['seconds'], peak))
+  print('  {0:14}{1:>10.3f} s'.format('total', total))
+
+
+def main(args):
+  parser = argparse.ArgumentParser(description='JSON to Cameo benchmarks')
+  parser.add_argument('filename', nargs='?', default=SAMPLE)
+  parser.add_argument('--scales', default='1,10,100',
+                      help='comma separated spec scale factors')
+  parser.add_argument('--decoder', choices=NAMES, default='auto',
+                      help='json decoder for the json load stage')
+  parser.add_argument('--json', dest='json_output',
+                      help='also write the results to this json file')
+  options = parser.parse_args(args)
+  spec = read_json_file(options.filename)
+  decoder = get_decoder(options.decoder)[0]
+  print('json decoder: {0}'.format(decoder))
+  all_results = dict()
+  with tempfile.TemporaryDirectory() as specs:
+    for scale in [int(i) for i in options.scales.split(',')]:
+      if scale == 1:
+        filename = options.filename
+      else:
+        filename = os.path.join(specs, 'spec_x{0}.json'.format(scale))
+        with open(filename, 'w') as spec_file:
+          json.dump(scale_spec(spec, scale), spec_file)
+      name = '{0} x{1}'.format(os.path.basename(options.filename), scale)
+      all_results[name] = benchmark(filename, decoder)
+      print_results(name, all_results[name])
+      if scale != 1:
+        os.remove(filename)
+  if options.json_output:
+    with open(options.json_output, 'w') as json_file:
+      json.dump(all_results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,71 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.batch import same_output  # noqa: E402
+from benchmarks.pipeline import scale_spec  # noqa: E402
+from json2cameo import JsonToCameo, read_json_file  # noqa: E402
+from scripts.output import FileOutput  # noqa: E402
+
+SAMPLE = os.path.join(ROOT, 'sample_data', 'shr_spec.json')
+
+
+# Output that waits before each file, like slow or network storage
+class SlowOutput(FileOutput):
+
+  def __init__(self, directory: str, latency: float):
+    super().__init__(directory)
+    self.latency = latency
+
+  @contextmanager
+  def open(self, name: str):
+    time.sleep(self.latency)
+    with super().open(name) as outfile:
+      yield outfile
+
+
+# Converts the spec serially or pipelined, returning wall time and the
+# traced peak memory of building and writing
+def run(spec: dict, output: str, latency: float, pipelined: bool) -> tuple:
+  tracemalloc.start()
+  start = time.perf_counter()
+  JsonToCameo(json_data=spec, backend=SlowOutput(output, latency),
+              pipelined=pipelined).all_files()
+  seconds = time.perf_counter() - start
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return seconds, peak
+
+
+def main(args):
+  parser = argparse.ArgumentParser(description='Pipelined mode benchmark')
+  parser.add_argument('filename', nargs='?', default=SAMPLE)
+  parser.add_argument('--scale', type=int, default=10,
+                      help='spec scale factor')
+  parser.add_argument('--latency', type=float, default=2.0,
+                      help='milliseconds added to each file write')
+  options = parser.parse_args(args)
+  spec = scale_spec(read_json_file(options.filename), options.scale)
+  latency = options.latency / 1000
+  with tempfile.TemporaryDirectory() as directory:
+    serial = os.path.join(directory, 'serial')
+    pipelined = os.path.join(directory, 'pipelined')
+    results = [('serial',) + run(spec, serial, latency, False),
+               ('pipelined',) + run(spec, pipelined, latency, True)]
+    same = same_output(serial, pipelined)
+  print('x{0} spec, {1} ms per file'.format(options.scale, options.latency))
+  for name, seconds, peak in results:
+    text = '  {0:12}{1:>8.3f} s{2:>10} KiB peak'
+    print(text.format(name, seconds, peak // 1024))
+  print('  {0}'.format('same output' if same else 'DIFFERENT OUTPUT'))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,96 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from json2cameo import JsonToCameo, read_json_file  # noqa: E402
+from scripts.output import MemoryOutput  # noqa: E402
+
+SAMPLE = os.path.join(ROOT, 'sample_data', 'shr_spec.json')
+
+
+def code_value(label: str, system: str) -> dict:
+  return {
+      'min': 0, 'max': 1, 'type': 'IdentifiableValue',
+      'identifier': {'label': label, 'namespace': 'primitive'},
+      'constraints': [{'type': 'CodeConstraint',
+                       'code': {'system': system, 'code': label}}]
+  }
+
+
+def element(label: str, children: list) -> dict:
+  return {'type': 'DataElement', 'label': label, 'children': children}
+
+
+# Spec whose first namespace doesn't parse after looking up some
+# codesystems, so a selection must stop looking up where the build stops
+def failing_spec() -> dict:
+  missing = {'min': 0, 'max': 1, 'constraints': [],
+             'type': 'IdentifiableValue',
+             'identifier': {'label': 'Missing', 'namespace': 'shr.one'}}
+  namespaces = [
+      {'label': 'shr.one', 'children': [
+          element('First', [code_value('a', 'http://first.example'),
+                            missing]),
+          element('Second', [code_value('b', 'http://second.example')])]},
+      {'label': 'shr.two', 'children': [
+          element('Third', [code_value('c', 'http://third.example')])]}
+  ]
+  return {'children': [{'type': 'Namespaces', 'children': namespaces},
+                       {'type': 'ValueSets', 'children': []}]}
+
+
+# Converts a spec into memory, returning the files and the seconds taken
+def convert(spec: dict, select: list=None) -> tuple:
+  memory = MemoryOutput()
+  start = time.perf_counter()
+  with contextlib.redirect_stdout(io.StringIO()):
+    JsonToCameo(json_data=spec, backend=memory, select=select).all_files()
+  return memory.files, time.perf_counter() - start
+
+
+# Names of every namespace and value set namespace in a spec
+def spec_namespaces(spec: dict) -> list:
+  names = set()
+  for section in spec.get('children', []):
+    if section.get('type') == 'Namespaces':
+      names.update(i.get('label', '') for i in section.get('children', []))
+    elif section.get('type') == 'ValueSets':
+      names.update(i.get('namespace', '') for i in section.get('children', []))
+  return sorted(names)
+
+
+# Selects each namespace on its own and counts the selections whose files
+# differ from converting the whole spec
+def check(name: str, spec: dict) -> None:
+  full, full_seconds = convert(spec)
+  names = spec_namespaces(spec)
+  different = []
+  seconds = 0
+  for namespace in names:
+    files, selected_seconds = convert(spec, [namespace])
+    seconds += selected_seconds
+    if any(full.get(i) != files[i] for i in files):
+      different.append(namespace)
+  text = '{0:20}{1:>4} selections{2:>8.3f} s full{3:>8.3f} s each  {4}'
+  print(text.format(name, len(names), full_seconds, seconds / len(names),
+                    'DIFFERENT: ' + ', '.join(different) if different
+                    else 'same output'))
+
+
+def main(args):
+  parser = argparse.ArgumentParser(description='Selective conversion check')
+  parser.add_argument('filenames', nargs='*', default=[SAMPLE])
+  options = parser.parse_args(args)
+  check('failing namespace', failing_spec())
+  for filename in options.filenames:
+    check(os.path.basename(filename), read_json_file(filename))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,38 @@
+import argparse
+import sys
+
+from scripts.codesystems import CodeSystemRegistry
+from scripts.importer import CameoImporter
+from scripts.output import write_json_atomic
+
+
+def parse_args(args):
+  parser = argparse.ArgumentParser(description='Convert Cameo to SHR json')
+  parser.add_argument('inputs', nargs='+',
+                      help='cameo .txt files or directories of them')
+  parser.add_argument('-o', '--output', default='spec.json',
+                      help='spec json file to write')
+  parser.add_argument('--codesystems',
+                      help='codesystem abbreviations config json file')
+  parser.add_argument('--codesystems-cache',
+                      help='save abbreviations read from the text that '
+                      'aren\'t in the config here, for converting back')
+  return parser.parse_args(args)
+
+
+def main(args):
+  options = parse_args(args)
+  registry = CodeSystemRegistry(options.codesystems, options.codesystems_cache)
+  importer = CameoImporter(registry)
+  for i in options.inputs:
+    importer.read_path(i)
+  write_json_atomic(options.output, importer.to_json())
+  registry.save_cache()
+  for i in sorted(importer.unresolved):
+    print('UNRESOLVED', i)
+  for label, namespace in sorted(importer.ambiguous):
+    print('AMBIGUOUS', label, namespace)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
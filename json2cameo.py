@@ -1,26 +1,149 @@
-import json
-import os
+import argparse
+import cProfile
 import sys
 
+from scripts import parallel, profiling
+from scripts.codesystems import CodeSystemRegistry, CodeSystems
+from scripts.codesystems import spec_codesystems, use_registry
+from scripts.decoders import NAMES, read_json
+from scripts.graph import DependencyGraph, namespace_uses
+from scripts.incremental import IncrementalBuild
 from scripts.namespace import Namespaces
+from scripts.output import ArchiveOutput, FileOutput, write_json_atomic
+from scripts.output import namespace_filename, value_set_filename
+from scripts.pipeline import Pipeline
+from scripts.selection import Selection
+from scripts.stream import SpecStream
 from scripts.value_sets import ValueSets
 
 
-def read_json_file(filename):
-  with open(filename, 'r') as json_file:
-    return json.load(json_file)
+# Decodes a spec file with the named decoder, the fastest installed one
+# by default
+def read_json_file(filename, decoder: str=None):
+  return read_json(filename, decoder)
+
+
+# Writes a namespace or valueset namespace to a stream, text rendered by
+# parallel workers is written as is
+def write_model(stream, model) -> None:
+  if isinstance(model, str):
+    stream.write(model)
+  else:
+    model.write_to(stream)
 
 
 class JsonToCameo:
 
   def __init__(self, json_data: dict=None, filename: str='',
-               output: str='out/'):
+               output: str='out/', streaming: bool=False, jobs: int=0,
+               incremental: bool=False, backend=None,
+               codesystems: CodeSystemRegistry=None,
+               codesystems_cache: str=None, decoder: str=None,
+               pipelined: bool=False, select: list=None):
     self.error_checking(json_data, filename)
+    if streaming and not filename:
+      raise Exception('streaming requires a filename')
+    elif sum([streaming, jobs > 1, incremental]) > 1:
+      raise Exception('Can\'t combine streaming, parallel and incremental')
+    elif pipelined and (jobs > 1 or incremental):
+      raise Exception('Can\'t pipeline parallel or incremental builds')
+    elif select is not None and (jobs > 1 or incremental):
+      raise Exception('Can\'t select namespaces of parallel or incremental '
+                      'builds')
     self.output = output if output[-1] == '/' else output + '/'
-    os.makedirs(self.output, exist_ok=True)
-    n, v = self.get_data(json_data, filename)
-    self.namespaces = Namespaces(n)
-    self.value_sets = ValueSets(v)
+    # Name of the json decoder, see scripts/decoders.py
+    self.decoder = decoder
+    # Names or glob patterns of the namespaces to convert, None for all
+    self.select = Selection(select) if select is not None else None
+    # Where output files go, FileOutput, ArchiveOutput or MemoryOutput
+    self.backend = backend if backend is not None else FileOutput(self.output)
+    if incremental and not isinstance(self.backend, FileOutput):
+      raise Exception('incremental mode requires a FileOutput backend')
+    # Manifest of an incremental build, saved after the files are written,
+    # its dependency graph and the namespaces whose json changed
+    self.manifest = None
+    self.graph = None
+    self.changed = None
+    # Pipelined builds parse, render and write these spec children together
+    # in all_files instead of building the model up front
+    self.pipeline = None
+    self.children = None
+    # Each conversion has its own abbreviations unless given a registry
+    if codesystems is None:
+      codesystems = CodeSystemRegistry(cache_path=codesystems_cache)
+    self.codesystems = codesystems
+    with use_registry(self.codesystems):
+      if pipelined:
+        self.build_pipeline(json_data, filename, streaming)
+      else:
+        self.build(json_data, filename, streaming, jobs, incremental)
+
+  # Builds the namespaces and valuesets with the selected mode
+  def build(self, json_data: dict, filename: str, streaming: bool,
+            jobs: int, incremental: bool) -> None:
+    profiling.set_info('mode', 'streaming' if streaming else
+                       'parallel' if jobs > 1 else
+                       'incremental' if incremental else 'serial')
+    if streaming:
+      with profiling.timer('stage', 'stream build'):
+        self.namespaces, self.value_sets = self.stream_data(filename)
+      return
+    with profiling.timer('stage', 'json load'):
+      n, v = self.get_data(json_data, filename)
+    with profiling.timer('stage', 'build'):
+      if jobs > 1:
+        self.namespaces, self.value_sets = self.parallel_data(n, v, jobs)
+      elif incremental:
+        build = IncrementalBuild(n, v, self.output)
+        self.namespaces, self.value_sets = build.namespaces, build.value_sets
+        self.manifest = build.manifest
+        self.graph = build.graph
+        self.changed = build.changed
+      else:
+        self.namespaces = Namespaces(n, self.select)
+        self.value_sets = ValueSets(v, self.select)
+
+  # Sets up a pipelined build over the spec children, read one at a time
+  # when streaming. Namespaces stays empty as models are dropped once
+  # they're written.
+  def build_pipeline(self, json_data: dict, filename: str,
+                     streaming: bool) -> None:
+    profiling.set_info('mode', 'pipelined streaming' if streaming else
+                       'pipelined')
+    self.pipeline = Pipeline(self.backend, self.codesystems,
+                             select=self.select)
+    if streaming:
+      self.namespaces = Namespaces({})
+      with profiling.timer('stage', 'codesystem scan'):
+        CodeSystems.seed(SpecStream(filename).codesystems())
+      self.children = self.stream_children(filename)
+    else:
+      with profiling.timer('stage', 'json load'):
+        n, v = self.get_data(json_data, filename)
+      self.namespaces = Namespaces({'label': n.get('label', ''),
+                                    'type': n.get('type', '')})
+      self.children = [('Namespaces', i) for i in n.get('children', [])]
+      self.children += [('ValueSets', i) for i in v.get('children', [])]
+    self.value_sets = ValueSets({})
+
+  # Yields spec children as they're decoded, checking the sections at the end
+  def stream_children(self, filename: str):
+    stream = SpecStream(filename)
+    yield from stream
+    sections = {i.get('type'): i for i in stream.sections}
+    if 'Namespaces' not in sections or 'ValueSets' not in sections:
+      raise Exception('Missing Namespaces or ValueSets')
+    self.namespaces.label = sections['Namespaces'].get('label', '')
+    self.namespaces.type = sections['Namespaces'].get('type', '')
+
+  # Graph of the namespaces each namespace uses, an incremental build has it
+  # for every namespace in the manifest including ones it didn't parse
+  def dependency_graph(self) -> DependencyGraph:
+    if self.pipeline is not None and self.graph is None:
+      self.graph = DependencyGraph(self.pipeline.uses)
+    if self.graph is None:
+      self.graph = DependencyGraph(namespace_uses(self.namespaces.namespaces))
+    return self.graph
 
   # Does some basic checking to on the input data
   def error_checking(self, d: dict, f: str) -> None:
@@ -35,12 +158,13 @@ class JsonToCameo:
     elif f and f.rpartition('.')[2] != 'json':
       raise Exception('file must end in .json')
 
-  # Get the namespaces and valuesets dictionaries
+  # Get the namespaces and valuesets dictionaries, the spec's own
+  # codesystems are abbreviated first in one pass
   def get_data(self, json_data: dict, filename: str) -> dict:
     if json_data is not None:
       data = json_data
     else:
-      data = read_json_file(filename)
+      data = read_json_file(filename, self.decoder)
     namespaces = None
     valuesets = None
     for i in data.get('children', []):
@@ -48,38 +172,157 @@ class JsonToCameo:
         namespaces = i
       elif i.get('type') == 'ValueSets':
         valuesets = i
+      elif i.get('type') == 'CodeSystems':
+        CodeSystems.seed(spec_codesystems(i))
     if namespaces is None or valuesets is None:
       raise Exception('Missing Namespaces or ValueSets')
     return namespaces, valuesets
 
+  # Builds namespaces and valuesets one spec child at a time, so only a
+  # single namespace or value set is decoded in memory at once. Specs list
+  # their CodeSystems last, so a first pass reads just their urls to
+  # abbreviate them first as the other modes do.
+  def stream_data(self, filename: str) -> tuple:
+    namespaces = Namespaces({}, self.select)
+    value_sets = ValueSets({}, self.select)
+    stream = SpecStream(filename)
+    with profiling.timer('stage', 'codesystem scan'):
+      CodeSystems.seed(stream.codesystems())
+    for section_type, child in stream:
+      if section_type == 'Namespaces':
+        namespaces.parse_namespaces([child])
+      elif section_type == 'ValueSets':
+        value_sets.parse_children([child])
+    sections = {i.get('type'): i for i in stream.sections}
+    if 'Namespaces' not in sections or 'ValueSets' not in sections:
+      raise Exception('Missing Namespaces or ValueSets')
+    namespaces.label = sections['Namespaces'].get('label', '')
+    namespaces.type = sections['Namespaces'].get('type', '')
+    return namespaces, value_sets
+
+  # Converts over a process pool, the workers return rendered text so the
+  # namespace and valueset dicts map each label to its output string. The
+  # workers also return each namespace's uses for the dependency graph.
+  def parallel_data(self, n: dict, v: dict, jobs: int) -> tuple:
+    namespaces = Namespaces({'label': n.get('label', ''),
+                             'type': n.get('type', '')})
+    value_sets = ValueSets({})
+    rendered_ns, rendered_vs, uses = parallel.convert(n, v, jobs)
+    self.graph = DependencyGraph(uses)
+    namespaces.namespaces = rendered_ns
+    value_sets.value_sets = rendered_vs
+    return namespaces, value_sets
+
   # Writes the valuesets to files
   def vs_to_file(self) -> None:
     value_sets = self.value_sets.value_sets
     for i in value_sets:
-      name = i.replace('.', '_')
-      with open('{0}{1}_vs.txt'.format(self.output, name), 'w') as outfile:
-        outfile.write(str(value_sets[i]))
+      filename = value_set_filename(i)
+      with profiling.timer('write', filename):
+        with self.backend.open(filename) as outfile:
+          write_model(outfile, value_sets[i])
+    self.backend.flush()
 
   # Writes the namespaces to file
   def ns_to_file(self) -> None:
-    namespaces = self.namespaces.namespaces
-    for i in namespaces:
-      name = i.replace('.', '_')
-      with open('{0}{1}.txt'.format(self.output, name), 'w') as outfile:
-        outfile.write(str(namespaces[i]))
+    for label, model in self.namespaces.namespaces.items():
+      filename = namespace_filename(label)
+      with profiling.timer('write', filename):
+        with self.backend.open(filename) as outfile:
+          write_model(outfile, model)
+    self.backend.flush()
 
-  # Write all output files
+  # Write all output files and close the output backend
   def all_files(self) -> None:
-    self.vs_to_file()
-    self.ns_to_file()
+    with profiling.timer('stage', 'write'), use_registry(self.codesystems):
+      if self.pipeline is not None:
+        self.pipeline.run(self.children)
+      else:
+        self.vs_to_file()
+        self.ns_to_file()
+      self.backend.close()
+    if self.select is not None:
+      for pattern in self.select.unmatched():
+        print('No namespace matches', pattern)
+    self.codesystems.save_cache()
+    if self.manifest is not None:
+      self.manifest.save()
+
+
+def parse_args(args):
+  parser = argparse.ArgumentParser(description='Convert SHR json to Cameo')
+  parser.add_argument('filename', help='spec json file')
+  parser.add_argument('output', nargs='?', default='out/',
+                      help='output directory')
+  parser.add_argument('--stream', action='store_true',
+                      help='decode the spec one namespace at a time')
+  parser.add_argument('-j', '--jobs', type=int, default=0,
+                      help='convert namespaces over this many processes')
+  parser.add_argument('-i', '--incremental', action='store_true',
+                      help='only regenerate namespaces whose json changed')
+  parser.add_argument('--pipeline', action='store_true',
+                      help='parse, render and write concurrently, holding '
+                      'only a few namespaces at once. Combines with --stream')
+  parser.add_argument('--select', action='append', metavar='NAMESPACE',
+                      help='only convert this namespace and its value sets, '
+                      'can be a glob pattern and be given more than once')
+  parser.add_argument('--archive',
+                      help='write one .zip/.tar/.tar.gz archive instead')
+  parser.add_argument('--batch-size', type=int, default=0,
+                      help='buffer this many characters of output files '
+                      'in memory and write them out together')
+  parser.add_argument('--codesystems',
+                      help='codesystem abbreviations config json file')
+  parser.add_argument('--codesystems-cache',
+                      help='load and save generated abbreviations here so '
+                      'they stay the same across runs')
+  parser.add_argument('--decoder', choices=NAMES, default='auto',
+                      help='json decoder, auto picks the fastest installed '
+                      'one. --stream always uses the stdlib decoder')
+  parser.add_argument('--graph',
+                      help='write the namespace dependency graph to this '
+                      '.dot or .json file')
+  parser.add_argument('--profile-report',
+                      help='write per namespace, constraint type and file '
+                      'timings and counters to this json file')
+  parser.add_argument('--cprofile',
+                      help='write cProfile stats for the run to this file')
+  return parser.parse_args(args)
 
 
 def main(args):
-  if len(args) == 1:
-    j2c = JsonToCameo(filename=args[0])
+  options = parse_args(args)
+  if options.profile_report:
+    profiling.enable()
+  profiler = cProfile.Profile() if options.cprofile else None
+  if profiler is not None:
+    profiler.enable()
+  try:
+    convert(options)
+  finally:
+    if profiler is not None:
+      profiler.disable()
+      profiler.dump_stats(options.cprofile)
+  if options.profile_report:
+    write_json_atomic(options.profile_report, profiling.active.report())
+    profiling.disable()
+
+
+def convert(options) -> None:
+  if options.archive:
+    backend = ArchiveOutput(options.archive)
   else:
-    j2c = JsonToCameo(filename=args[0], output=args[1])
+    backend = FileOutput(options.output, batch_size=options.batch_size)
+  j2c = JsonToCameo(filename=options.filename, output=options.output,
+                    streaming=options.stream, jobs=options.jobs,
+                    incremental=options.incremental, backend=backend,
+                    decoder=options.decoder, pipelined=options.pipeline,
+                    select=options.select,
+                    codesystems=CodeSystemRegistry(
+                        options.codesystems, options.codesystems_cache))
   j2c.all_files()
+  if options.graph:
+    j2c.dependency_graph().write(options.graph, j2c.changed)
 
 
 if __name__ == '__main__':
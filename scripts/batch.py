@@ -0,0 +1,210 @@
+import argparse
+import hashlib
+import os
+import sys
+
+from scripts import parallel
+from scripts.codesystems import CodeSystemRegistry, CodeSystems
+from scripts.codesystems import spec_codesystems, use_registry
+from scripts.incremental import build_recorded, codesystem_hash, content_hash
+from scripts.namespace import Namespace
+from scripts.output import FileOutput, namespace_filename, value_set_filename
+from scripts.stream import SpecStream
+from scripts.value_sets import ValueSet, ValueSets
+
+# Unique subtrees handed to each worker process by init_worker
+worker_subtrees = dict()
+
+
+def init_worker(subtrees: dict, state: dict) -> None:
+  worker_subtrees.update(subtrees)
+  CodeSystems.set_state(state)
+
+
+# Builds a namespace or value set and returns the codesystems it looked up
+# and whether it parsed. Lookups don't depend on the abbreviations, so
+# they're shared by every spec containing the subtree.
+def record_subtree(subtrees: dict, task: tuple) -> tuple:
+  kind, digest = task
+  cls = Namespace if kind == 'Namespaces' else ValueSet
+  model, lookups = build_recorded(cls, subtrees[digest])
+  return digest, lookups, model is not None
+
+
+# Renders namespaces and groups of value sets sharing a namespace with one
+# spec's final abbreviations
+def render_subtrees(subtrees: dict, task: tuple) -> list:
+  state, items = task
+  rendered = []
+  with use_registry(CodeSystemRegistry.from_state(state)):
+    for kind, key, digests in items:
+      if kind == 'Namespaces':
+        text = str(Namespace(subtrees[digests[0]]))
+      else:
+        children = [subtrees[i] for i in digests]
+        value_sets = ValueSets({'children': children}).value_sets
+        text = str(next(iter(value_sets.values())))
+      rendered.append((key, text))
+  return rendered
+
+
+def record_in_worker(task: tuple) -> tuple:
+  return record_subtree(worker_subtrees, task)
+
+
+def render_in_worker(task: tuple) -> list:
+  return render_subtrees(worker_subtrees, task)
+
+
+# Converts many specs into a directory each, named after the spec file.
+# Namespaces and value sets shared between specs are parsed once, and
+# rendered once for every distinct set of abbreviations they depend on,
+# so each directory matches converting its spec on its own.
+class BatchBuild:
+
+  def __init__(self, filenames: list, output: str, jobs: int=0,
+               codesystems_path: str=None):
+    self.output = output
+    self.jobs = jobs
+    self.base_state = CodeSystemRegistry(codesystems_path).get_state()
+    # Namespace and value set json by content hash
+    self.subtrees = dict()
+    self.kinds = dict()
+    self.total = 0
+    self.specs = [self.read_spec(i) for i in filenames]
+    names = [i['name'] for i in self.specs]
+    for name in names:
+      if names.count(name) > 1:
+        raise Exception('Duplicate spec name {0}'.format(name))
+    # Codesystem lookups of each subtree and whether it parsed
+    self.lookups = dict()
+    self.parsed = dict()
+    # Rendered text by (kind, digest, codesystem hash)
+    self.rendered = dict()
+
+  # Keys a subtree by a hash of its json text, hashing the text as read is
+  # much cheaper than re-encoding the subtree for content_hash
+  def add_subtree(self, kind: str, child: dict, text: str) -> str:
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    self.subtrees.setdefault(digest, child)
+    self.kinds.setdefault(digest, kind)
+    self.total += 1
+    return digest
+
+  # Reads a spec into the hashes of its namespaces and value sets
+  def read_spec(self, filename: str) -> dict:
+    namespaces = []
+    value_sets = []
+    codesystems = []
+    stream = SpecStream(filename, raw=True)
+    for section_type, child, text in stream:
+      if section_type == 'Namespaces':
+        digest = self.add_subtree(section_type, child, text)
+        namespaces.append((child.get('label', ''), digest))
+      elif section_type == 'ValueSets':
+        digest = self.add_subtree(section_type, child, text)
+        value_sets.append((child.get('namespace', ''), digest))
+      elif section_type == 'CodeSystems':
+        codesystems.append(child)
+    types = [i.get('type') for i in stream.sections]
+    if 'Namespaces' not in types or 'ValueSets' not in types:
+      raise Exception('{0} is missing Namespaces or ValueSets'.format(
+          filename))
+    return {
+        'name': os.path.basename(filename).rpartition('.')[0],
+        'namespaces': namespaces,
+        'value_sets': value_sets,
+        'codesystems': spec_codesystems({'children': codesystems})
+    }
+
+  # Records lookups, plans every spec's outputs, renders each distinct
+  # output once and writes the files
+  def run(self) -> None:
+    tasks = [(self.kinds[i], i) for i in self.subtrees]
+    if self.jobs > 1:
+      init_args = (self.subtrees, self.base_state)
+      with parallel.get_context().Pool(self.jobs, init_worker,
+                                       init_args) as pool:
+        self.save_lookups(pool.map(record_in_worker, tasks, chunksize=8))
+        results = pool.map(render_in_worker, self.plan())
+    else:
+      with use_registry(CodeSystemRegistry.from_state(self.base_state)):
+        self.save_lookups([record_subtree(self.subtrees, i) for i in tasks])
+      results = [render_subtrees(self.subtrees, i) for i in self.plan()]
+    for rendered in results:
+      self.rendered.update(rendered)
+    self.write()
+
+  def save_lookups(self, results: list) -> None:
+    for digest, lookups, parsed in results:
+      self.lookups[digest] = lookups
+      self.parsed[digest] = parsed
+
+  # Replays each spec's lookups in document order to get its abbreviations,
+  # then returns render tasks for outputs not rendered for an earlier spec
+  def plan(self) -> list:
+    tasks = []
+    planned = set()
+    for spec in self.specs:
+      registry = CodeSystemRegistry.from_state(self.base_state)
+      files = dict()
+      items = []
+      with use_registry(registry):
+        CodeSystems.seed(spec['codesystems'])
+        for _, digest in spec['namespaces'] + spec['value_sets']:
+          CodeSystems.replay(self.lookups[digest])
+
+        for label, digest in spec['namespaces']:
+          if not self.parsed[digest]:
+            continue
+          lookups = self.lookups[digest]
+          key = ('Namespaces', digest, codesystem_hash(lookups))
+          files[namespace_filename(label)] = key
+          items.append((key, [digest]))
+
+        groups = dict()
+        for namespace, digest in spec['value_sets']:
+          groups.setdefault(namespace, []).append(digest)
+        for namespace, digests in groups.items():
+          lookups = [c for i in digests for c in self.lookups[i]]
+          key = ('ValueSets', content_hash(digests), codesystem_hash(lookups))
+          files[value_set_filename(namespace)] = key
+          items.append((key, digests))
+      spec['files'] = files
+
+      items = [(k[0], k, d) for k, d in items if k not in planned]
+      planned.update(i[1] for i in items)
+      if items:
+        state = registry.get_state()
+        for group in parallel.chunk(items, max(self.jobs, 1)):
+          tasks.append((state, group))
+    return tasks
+
+  def write(self) -> None:
+    for spec in self.specs:
+      backend = FileOutput(os.path.join(self.output, spec['name']))
+      for filename, key in spec['files'].items():
+        with backend.open(filename) as outfile:
+          outfile.write(self.rendered[key])
+      backend.close()
+
+
+def main(args):
+  parser = argparse.ArgumentParser(description='Convert many SHR specs')
+  parser.add_argument('output', help='directory for a folder per spec')
+  parser.add_argument('filenames', nargs='+', help='spec json files')
+  parser.add_argument('-j', '--jobs', type=int, default=0,
+                      help='convert over this many processes')
+  parser.add_argument('--codesystems',
+                      help='codesystem abbreviations config json file')
+  options = parser.parse_args(args)
+  build = BatchBuild(options.filenames, options.output, options.jobs,
+                     options.codesystems)
+  build.run()
+  text = 'Converted {0} specs, {1} of {2} subtrees unique, {3} rendered'
+  print(text.format(len(build.specs), len(build.subtrees), build.total,
+                    len(build.rendered)))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -1,49 +1,243 @@
 import json
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
 
+from scripts.output import write_json_atomic
 
-# Initiate class to singleton, only one instance
-def singleton(cls):
-  return cls()
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
 
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Environment variable overriding the default codesystems config file
+PATH_VARIABLE = 'JSON2CAMEO_CODESYSTEMS'
 
-# Manages codesystem abbreviation and generates new ones if they don't exist
-@singleton
-class CodeSystems:
+
+# Normalizes a codesystem url so near duplicates share an abbreviation,
+# ignoring http vs https, a leading www. and trailing slashes
+def normalize(codesystem: str) -> str:
+  url = codesystem.strip()
+  scheme, sep, rest = url.partition('://')
+  if sep and scheme.lower() in ('http', 'https'):
+    url = rest
+  if url.startswith('www.'):
+    url = url[4:]
+  return url.rstrip('/')
+
+
+# Urls of the codesystems defined in a spec's CodeSystems section
+def spec_codesystems(section: dict) -> list:
+  return [i.get('url') for i in section.get('children', []) if i.get('url')]
+
+
+# Reads an abbreviation cache file of url to abbreviation
+def read_cache(path: str) -> dict:
+  if not os.path.exists(path):
+    return dict()
+  with open(path, 'r') as cache_file:
+    return json.load(cache_file)
+
+
+# Serializes cache updates between processes where file locks exist. The
+# cache's directory is locked, as the cache itself is replaced on each save
+# and a separate lock file would be left behind.
+@contextmanager
+def cache_lock(path: str):
+  if fcntl is None:
+    yield
+    return
+  fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+  try:
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    yield
+  finally:
+    os.close(fd)
+
+
+# Config file used when a registry isn't given a path
+def default_path() -> str:
+  path = os.environ.get(PATH_VARIABLE)
+  return path if path else os.path.join(ROOT, 'config', 'codesystems.json')
+
+
+# Manages codesystem abbreviation and generates new ones if they don't exist.
+# The config file is only read on the first lookup.
+class CodeSystemRegistry:
   BANNED = ['urn:oid', 'standardhealthrecord']
 
-  def __init__(self):
-    with open('./config/codesystems.json', 'r') as code_file:
+  def __init__(self, path: str=None, cache_path: str=None):
+    self.path = path if path is not None else default_path()
+    # Abbreviations generated by earlier runs, see save_cache
+    self.cache_path = cache_path
+    # Urls abbreviated by this registry that aren't in the config or cache
+    self.minted = dict()
+    self.loaded = False
+    # Abbreviation every looked up codesystem resolved to, '' when banned
+    self.resolved = dict()
+    # Ordered codesystems looked up while recording, None when not recording
+    self.recorded = None
+
+  # Returns a registry that starts from a get_state snapshot
+  @classmethod
+  def from_state(cls, state: dict, path: str=None) -> 'CodeSystemRegistry':
+    registry = cls(path)
+    registry.set_state(state)
+    return registry
+
+  def load(self) -> None:
+    with open(self.path, 'r') as code_file:
       self.codesystems = json.load(code_file)
-    self.abbrev_set = set(self.codesystems[i] for i in self.codesystems)
+    self.build_indexes()
     # Initialize defualt abbreviation to 'AAA' in bytes
     self.next_abbreviation = [65, 65, 65]
+    self.loaded = True
+    if self.cache_path:
+      self.load_cache()
+
+  # Adds abbreviations from the cache that don't clash with the config
+  def load_cache(self) -> None:
+    cache = read_cache(self.cache_path)
+    for codesystem in cache:
+      abbrev = cache[codesystem]
+      if codesystem in self.codesystems or abbrev in self.abbreviations:
+        continue
+      self.update_codesystems(codesystem, abbrev)
+
+  # Merges newly generated abbreviations into the cache file. Entries saved
+  # by other runs first win, a clashing abbreviation is generated again
+  # and saved by a later run.
+  def save_cache(self) -> None:
+    if not self.cache_path or not self.minted:
+      return
+    with cache_lock(self.cache_path):
+      cache = read_cache(self.cache_path)
+      used = set(cache.values())
+      for codesystem in self.minted:
+        abbrev = self.minted[codesystem]
+        if codesystem not in cache and abbrev not in used:
+          cache[codesystem] = abbrev
+          used.add(abbrev)
+      write_json_atomic(self.cache_path, cache)
+    self.minted = dict()
+
+  # Resets the lookup caches for the current codesystems
+  def build_indexes(self) -> None:
+    self.resolved = dict()
+    self.normalized = dict()
+    # Reverse index of abbreviation to the first url given it
+    self.abbreviations = dict()
+    for i in self.codesystems:
+      self.normalized.setdefault(normalize(i), self.codesystems[i])
+      self.abbreviations.setdefault(self.codesystems[i], i)
+
+  # Resolves codesystem urls in one bulk pass before any lookups, so new
+  # urls are abbreviated in the order given rather than the order the
+  # spec's elements happen to reference them
+  def seed(self, codesystems: list) -> None:
+    for codesystem in codesystems:
+      if codesystem is not None and codesystem not in self.resolved:
+        self.resolve(codesystem)
+
+  # Returns the url an abbreviation stands for, or None
+  def get_url(self, abbrev: str) -> str:
+    if not self.loaded:
+      self.load()
+    return self.abbreviations.get(abbrev)
 
   # Returns abbreviation for existing codesystem or new one
   def get(self, codesystem: str) -> str:
     if codesystem is None:
       return ''
-    elif any(b in codesystem for b in self.BANNED):
-      return ''
+    abbrev = self.resolved.get(codesystem)
+    if abbrev is None:
+      abbrev = self.resolve(codesystem)
+    if abbrev and self.recorded is not None:
+      self.recorded[codesystem] = None
+    return abbrev
+
+  # Classifies a codesystem once as banned, known, a near duplicate of a
+  # known url or new, in which case it gets the next abbreviation
+  def resolve(self, codesystem: str) -> str:
+    if not self.loaded:
+      self.load()
+    if any(b in codesystem for b in self.BANNED):
+      abbrev = ''
     elif codesystem in self.codesystems:
-      return self.codesystems[codesystem]
+      abbrev = self.codesystems[codesystem]
     else:
-      abbrev = self.get_next_abbreviation()
+      abbrev = self.normalized.get(normalize(codesystem))
+      if abbrev is None:
+        abbrev = self.get_next_abbreviation()
       self.update_codesystems(codesystem, abbrev)
-      return abbrev
+      self.minted[codesystem] = abbrev
+    self.resolved[codesystem] = abbrev
+    return abbrev
+
+  # Returns the url a codesystem is declared under, the first one given its
+  # abbreviation, so near duplicates share one CodeSystem header line
+  def canonical(self, codesystem: str) -> str:
+    return self.abbreviations.get(self.get(codesystem), codesystem)
+
+  # Starts recording every abbreviated codesystem in lookup order
+  def start_recording(self) -> None:
+    self.recorded = dict()
+
+  # Stops recording and returns the codesystems looked up since starting
+  def stop_recording(self) -> list:
+    recorded = list(self.recorded)
+    self.recorded = None
+    return recorded
+
+  # Looks up recorded codesystems so new abbreviations are minted in the
+  # same order as when they were first recorded
+  def replay(self, codesystems: list) -> None:
+    for codesystem in codesystems:
+      self.get(codesystem)
+
+  # Returns a copy of the abbreviation state, e.g. to hand to other processes
+  def get_state(self) -> dict:
+    if not self.loaded:
+      self.load()
+    return {
+        'codesystems': dict(self.codesystems),
+        'next_abbreviation': list(self.next_abbreviation)
+    }
+
+  # Replaces the abbreviation state with one from get_state
+  def set_state(self, state: dict) -> None:
+    self.codesystems = dict(state['codesystems'])
+    self.next_abbreviation = list(state['next_abbreviation'])
+    self.build_indexes()
+    self.minted = dict()
+    self.loaded = True
+
+  # Adds an abbreviation read from elsewhere, e.g. imported Cameo text,
+  # unless the url or abbreviation is taken. It's saved to the cache like
+  # a generated one.
+  def add(self, codesystem: str, abbrev: str) -> bool:
+    if not self.loaded:
+      self.load()
+    if codesystem in self.codesystems or abbrev in self.abbreviations:
+      return False
+    self.update_codesystems(codesystem, abbrev)
+    self.minted[codesystem] = abbrev
+    return True
 
   def update_codesystems(self, codesystem: str, abbrev: str) -> None:
     self.codesystems[codesystem] = abbrev
-    self.abbrev_set.add(abbrev)
+    self.abbreviations.setdefault(abbrev, codesystem)
+    self.normalized.setdefault(normalize(codesystem), abbrev)
+    self.resolved[codesystem] = abbrev
 
-  # Return next default abbreviation, checks to make sure it doesn't exist
+  # Return next default abbreviation, skipping ones already in use
   def get_next_abbreviation(self):
     next_abbrev = bytes(self.next_abbreviation).decode('utf-8')
-    while next_abbrev in self.codesystems:
+    while next_abbrev in self.abbreviations:
       self.update_abbreviation()
       next_abbrev = bytes(self.next_abbreviation).decode('utf-8')
-    else:
-      self.update_abbreviation()
-      self.abbrev_set.add(next_abbrev)
+    self.update_abbreviation()
     return next_abbrev
 
   # Updates default abbreviation byte array
@@ -60,7 +254,45 @@ class CodeSystems:
       array[2] += 1
 
 
-# Main function to run some basic tests on functionality
+default_registry = CodeSystemRegistry()
+current_registry = ContextVar('current_registry', default=None)
+
+
+# Returns the registry lookups currently go to
+def get_registry() -> CodeSystemRegistry:
+  registry = current_registry.get()
+  return registry if registry is not None else default_registry
+
+
+# Sends CodeSystems lookups in this thread or task to a registry
+@contextmanager
+def use_registry(registry: CodeSystemRegistry):
+  token = current_registry.set(registry)
+  try:
+    yield registry
+  finally:
+    current_registry.reset(token)
+
+
+# Forwards to the registry in use, so models call CodeSystems.get without
+# knowing which conversion they belong to
+class CodeSystemsProxy:
+
+  def get(self, codesystem: str) -> str:
+    return get_registry().get(codesystem)
+
+  def canonical(self, codesystem: str) -> str:
+    return get_registry().canonical(codesystem)
+
+  def __getattr__(self, name: str):
+    return getattr(get_registry(), name)
+
+
+CodeSystems = CodeSystemsProxy()
+
+
+# Main function to run some basic tests on functionality, run from the repo
+# root with python -m scripts.codesystems as it imports the scripts package
 def main():
   print(CodeSystems.get("http://example.com"))
   print(CodeSystems.get("http://www.dsm5.org/"))
@@ -1,33 +1,69 @@
 import re
 from collections import defaultdict
+from functools import lru_cache
+from types import MappingProxyType
+from scripts import profiling
 from scripts.codesystems import CodeSystems
 
+SHR_VALUE_SET = 'http://standardhealthrecord.org/shr/'
+VALUE_SET_USE = re.compile(r'shr/(.*)/vs')
+
+# Shared read-only codesystems and uses for models that don't reference any,
+# replaced by a real dict or set on the first addition
+EMPTY_CODESYSTEMS = MappingProxyType({})
+EMPTY_USES = frozenset()
+
 
 def parse_path(label, path_string):
   paths = [i.rpartition('.')[2] for i in path_string.split(':')]
   return '.'.join(filter(None, [label] + paths))
 
 
+# Resolves a value set url to the namespace it uses (or None) and the text
+# it renders as. The same bindings repeat across many elements, so each url
+# is only parsed once.
+@lru_cache(maxsize=4096)
+def resolve_value_set(valueset: str) -> tuple:
+  if SHR_VALUE_SET in valueset:
+    use = VALUE_SET_USE.search(valueset).group(1)
+    return 'shr.{0}'.format(use), valueset.rpartition('/')[2]
+  elif 'urn:tbd' in valueset:
+    return None, 'TBD "{0}"'.format(valueset.rpartition(':')[2])
+  return None, valueset
+
+
+# Hit and miss counts of the value set url cache
+def value_set_cache_stats() -> dict:
+  info = resolve_value_set.cache_info()
+  return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}
+
+
 class Constraints:
 
   def __init__(self, constraints: list, label: str=''):
     self.constraints = constraints
     self.label = label
-    self.codesystems = dict()
-    self.uses = set()
+    self.codesystems = EMPTY_CODESYSTEMS
+    self.uses = EMPTY_USES
     if constraints:
       self.c_type = constraints[0].get('type')
 
+  def add_codesystem(self, system: str, abbrev: str) -> None:
+    if self.codesystems is EMPTY_CODESYSTEMS:
+      self.codesystems = dict()
+    self.codesystems[CodeSystems.canonical(system)] = abbrev
+
+  def add_use(self, use: str) -> None:
+    if self.uses is EMPTY_USES:
+      self.uses = set()
+    self.uses.add(use)
+
   def get_value_set(self) -> str:
     binding = self.constraints[0].get('bindingStrength', '')
     cp = self.constraints[0].get('path', '')
-    valueset = self.constraints[0].get('valueset')
-    if 'http://standardhealthrecord.org/shr/' in valueset:
-      use = re.search(r'shr/(.*)/vs', valueset).group(1)
-      self.uses.add('shr.{0}'.format(use))
-      valueset = valueset.rpartition('/')[2]
-    elif 'urn:tbd' in valueset:
-      valueset = 'TBD "{0}"'.format(valueset.rpartition(':')[2])
+    use, valueset = resolve_value_set(self.constraints[0].get('valueset'))
+    if use is not None:
+      self.add_use(use)
 
     path = ' {0}.{1}'.format(self.label, cp.rpartition('.')[2]) if cp else ''
 
@@ -45,7 +81,7 @@ class Constraints:
     system = code.get('system')
     abbrev = CodeSystems.get(system)
     if system and abbrev and abbrev != 'TBD':
-      self.codesystems[system] = abbrev
+      self.add_codesystem(system, abbrev)
     display = code.get('display', '')
     text = '{0}#{1} "{2}"' if display else '{0}#{1}'
     source = text.format(abbrev, code.get('code'), display)
@@ -63,7 +99,7 @@ class Constraints:
       system = code.get('system')
       abbrev = CodeSystems.get(system)
       if system and abbrev and abbrev != 'TBD':
-        self.codesystems[system] = abbrev
+        self.add_codesystem(system, abbrev)
       display = code.get('display', '')
       text = '{0}#{1} "{2}"' if display else '{0}#{1}'
       source = text.format(abbrev, code.get('code'), display)
@@ -93,8 +129,7 @@ class Constraints:
       if i + 1 < len(self.constraints):
         c1 = self.constraints[i + 1]
         if c1.get('type') != 'CardConstraint' and path == c1.get('path', ''):
-          c1['path'] = ''
-          constraint_sub = str(Constraints([c1], label))
+          constraint_sub = str(Constraints([dict(c1, path='')], label))
           i += 1
       new_label = constraint_sub if constraint_sub else label
       cards.append('{0:20}{1}'.format(range_vals, new_label))
@@ -115,19 +150,90 @@ class Constraints:
     paths = sorted(list(types_dict.keys()))
     return '\n'.join('\n'.join([i] + types_dict[i]) for i in paths)
 
+  # The codesystem lookups of each renderer, made in the same order without
+  # rendering anything
+  def look_up_code(self) -> None:
+    CodeSystems.get(self.constraints[0].get('code').get('system'))
+
+  def look_up_includes_code(self) -> None:
+    for i in self.constraints:
+      CodeSystems.get(i.get('code').get('system'))
+
+  def look_up_card(self) -> None:
+    i = 0
+    while i < len(self.constraints):
+      path = self.constraints[i].get('path', '')
+      if i + 1 < len(self.constraints):
+        c1 = self.constraints[i + 1]
+        if c1.get('type') != 'CardConstraint' and path == c1.get('path', ''):
+          Constraints([dict(c1, path='')]).look_up()
+          i += 1
+      i += 1
+
+  def look_up_value_set(self) -> None:
+    resolve_value_set(self.constraints[0].get('valueset'))
+
+  def look_up_nothing(self) -> None:
+    pass
+
+  # Renderer for each constraint type, called with the Constraints instance
+  type_handler = {
+      'ValueSetConstraint': get_value_set,
+      'CodeConstraint': get_code,
+      'BooleanConstraint': get_boolean,
+      'IncludesCodeConstraint': get_includes_code,
+      'TypeConstraint': get_type,
+      'CardConstraint': get_card,
+      'IncludesTypeConstraint': get_includes_type
+  }
+
+  # Codesystem lookups of each renderer above, a type registered later has
+  # none here and is rendered for its lookups instead
+  lookup_handler = {
+      'ValueSetConstraint': look_up_value_set,
+      'CodeConstraint': look_up_code,
+      'BooleanConstraint': look_up_nothing,
+      'IncludesCodeConstraint': look_up_includes_code,
+      'TypeConstraint': look_up_nothing,
+      'CardConstraint': look_up_card,
+      'IncludesTypeConstraint': look_up_nothing
+  }
+
+  # Registers a renderer for a constraint type, replacing any existing one.
+  # Can be used as a decorator when handler is omitted.
+  @classmethod
+  def register(cls, c_type: str, handler=None):
+    if handler is None:
+      return lambda h: cls.register(c_type, h)
+    cls.type_handler[c_type] = handler
+    cls.lookup_handler.pop(c_type, None)
+    return handler
+
+  # Looks up the codesystems rendering would, in the same order, and returns
+  # whether rendering gives any text. Missing constraint types are reported
+  # when rendered, not here.
+  def look_up(self) -> bool:
+    if not self.constraints:
+      return False
+    handler = self.type_handler.get(self.c_type)
+    if handler is None:
+      return False
+    lookup = self.lookup_handler.get(self.c_type)
+    if lookup is None:
+      return bool(handler(self))
+    lookup(self)
+    return True
+
   def __str__(self):
-    type_handler = {
-        'ValueSetConstraint': self.get_value_set,
-        'CodeConstraint': self.get_code,
-        'BooleanConstraint': self.get_boolean,
-        'IncludesCodeConstraint': self.get_includes_code,
-        'TypeConstraint': self.get_type,
-        'CardConstraint': self.get_card,
-        'IncludesTypeConstraint': self.get_includes_type
-    }
     if not self.constraints:
       return ''
-    elif self.c_type not in type_handler:
+    handler = self.type_handler.get(self.c_type)
+    if handler is None:
       print(self.c_type, 'MISSING')
+      profiling.count('missing_constraint', self.c_type)
       return ''
-    return type_handler[self.c_type]()
\ No newline at end of file
+    if profiling.active is None:
+      return handler(self)
+    with profiling.timer('constraint', self.c_type):
+      return handler(self)
+
@@ -0,0 +1,55 @@
+import json
+import mmap
+import os
+
+from scripts import profiling
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+
+# The stdlib decoder needs bytes, so the mapped file is copied once
+def decode_json(data):
+  return json.loads(data[:])
+
+
+# orjson decodes straight from the mapped pages
+def decode_orjson(data):
+  with memoryview(data) as view:
+    return orjson.loads(view)
+
+
+# Decoders by name in order of preference, ones not installed are left out
+DECODERS = dict()
+if orjson is not None:
+  DECODERS['orjson'] = decode_orjson
+DECODERS['json'] = decode_json
+# Every name accepted by get_decoder, installed or not
+NAMES = ['auto', 'orjson', 'json']
+
+
+# Returns the name and function of a decoder, the fastest installed one for
+# 'auto' or None
+def get_decoder(name: str=None) -> tuple:
+  if name is None or name == 'auto':
+    name = next(iter(DECODERS))
+  elif name not in NAMES:
+    raise Exception('Unknown json decoder {0}'.format(name))
+  elif name not in DECODERS:
+    raise Exception('json decoder {0} isn\'t installed'.format(name))
+  return name, DECODERS[name]
+
+
+# Decodes a json file from a memory map of its bytes instead of reading it
+# into a str first
+def read_json(filename: str, decoder: str=None):
+  name, decode = get_decoder(decoder)
+  profiling.set_info('json_decoder', name)
+  with open(filename, 'rb') as json_file:
+    # Empty files can't be mapped
+    if not os.fstat(json_file.fileno()).st_size:
+      return decode(json_file.read())
+    with mmap.mmap(json_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      return decode(data)
@@ -0,0 +1,136 @@
+from collections import defaultdict
+
+from scripts.output import write_json_atomic
+
+
+# Namespace label to the namespaces it uses
+def namespace_uses(namespaces: dict) -> dict:
+  return {label: namespace.uses for label, namespace in namespaces.items()}
+
+
+# Graph of which namespaces use which. Namespaces using each other form a
+# cycle, so ordering works on strongly connected components.
+class DependencyGraph:
+
+  def __init__(self, uses: dict):
+    self.uses = {i: sorted(set(uses[i])) for i in uses}
+    self.used_by = defaultdict(set)
+    for label in self.uses:
+      for dependency in self.uses[label]:
+        self.used_by[dependency].add(label)
+    self.nodes = sorted(set(self.uses) | set(self.used_by))
+
+  def dependencies(self, label: str) -> list:
+    return self.uses.get(label, [])
+
+  def dependents(self, label: str) -> list:
+    return sorted(self.used_by.get(label, ()))
+
+  # Every namespace that uses one of labels, directly or through others
+  def transitive_dependents(self, labels) -> set:
+    found = set()
+    pending = list(labels)
+    while pending:
+      for dependent in self.used_by.get(pending.pop(), ()):
+        if dependent not in found:
+          found.add(dependent)
+          pending.append(dependent)
+    return found - set(labels)
+
+  # Strongly connected components with dependencies before dependents,
+  # found with Tarjan's algorithm on an explicit stack
+  def components(self) -> list:
+    index = dict()
+    low = dict()
+    stack = []
+    on_stack = set()
+    components = []
+    for root in self.nodes:
+      if root in index:
+        continue
+      index[root] = low[root] = len(index)
+      stack.append(root)
+      on_stack.add(root)
+      work = [(root, iter(self.dependencies(root)))]
+      while work:
+        node, edges = work[-1]
+        for dependency in edges:
+          if dependency not in index:
+            index[dependency] = low[dependency] = len(index)
+            stack.append(dependency)
+            on_stack.add(dependency)
+            work.append((dependency, iter(self.dependencies(dependency))))
+            break
+          elif dependency in on_stack:
+            low[node] = min(low[node], index[dependency])
+        else:
+          work.pop()
+          if work:
+            parent = work[-1][0]
+            low[parent] = min(low[parent], low[node])
+          if low[node] == index[node]:
+            component = []
+            while True:
+              member = stack.pop()
+              on_stack.discard(member)
+              component.append(member)
+              if member == node:
+                break
+            components.append(sorted(component))
+    return components
+
+  # Namespaces in dependency order, members of a cycle together
+  def topological_order(self) -> list:
+    return [i for component in self.components() for i in component]
+
+  # Groups namespaces into levels that only use namespaces of earlier
+  # levels or their own cycle, so each level can be processed concurrently
+  def levels(self) -> list:
+    levels = []
+    level_of = dict()
+    for component in self.components():
+      members = set(component)
+      level = 0
+      for label in component:
+        for dependency in self.dependencies(label):
+          if dependency not in members:
+            level = max(level, level_of[dependency] + 1)
+      for label in component:
+        level_of[label] = level
+      if level == len(levels):
+        levels.append([])
+      levels[level].extend(component)
+    return [sorted(i) for i in levels]
+
+  # Returns the graph as json data, with the namespaces an incremental run
+  # changed and their transitive dependents when given
+  def to_json(self, changed: list=None) -> dict:
+    data = {
+        'namespaces': {i: {
+            'uses': self.dependencies(i),
+            'used_by': self.dependents(i)
+        } for i in self.nodes},
+        'levels': self.levels(),
+        'cycles': [i for i in self.components() if len(i) > 1]
+    }
+    if changed is not None:
+      data['changed'] = sorted(changed)
+      data['affected'] = sorted(self.transitive_dependents(changed))
+    return data
+
+  def to_dot(self) -> str:
+    lines = ['digraph namespaces {']
+    for label in self.nodes:
+      lines.append('  "{0}";'.format(label))
+      for dependency in self.dependencies(label):
+        lines.append('  "{0}" -> "{1}";'.format(label, dependency))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+  # Writes DOT to a .dot or .gv path and json otherwise
+  def write(self, path: str, changed: list=None) -> None:
+    if path.endswith('.dot') or path.endswith('.gv'):
+      with open(path, 'w') as dot_file:
+        dot_file.write(self.to_dot())
+    else:
+      write_json_atomic(path, self.to_json(changed))
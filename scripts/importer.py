@@ -0,0 +1,521 @@
+import os
+from collections import defaultdict
+
+from scripts.codesystems import CodeSystemRegistry
+
+FIELDS = frozenset(['Grammar', 'Namespace', 'Description', 'Uses',
+                    'CodeSystem', 'EntryElement', 'Element', 'Based on',
+                    'Concept', 'Value', 'ValueSet'])
+# Indent of nested definitions, of property columns and of constraints
+# without a cardinality, relative to their element
+DEPTH_INDENT = 10
+FIELD_WIDTH = 20
+CONSTRAINT_INDENT = 30
+SHR_URL = 'http://standardhealthrecord.org/shr/'
+TBD_VALUE_SET = 'urn:tbd:'
+DESCENDENTS = 'Includes codes descending from '
+FROM_CODES = 'Includes codes from '
+
+
+# Splits Cameo text into (indent, field, value, text) tokens, one per line.
+# The field is None for blank lines and '' for lines that aren't a field,
+# text is the line without its indent. Descriptions spanning several lines
+# are joined back into a single token.
+def tokenize(lines):
+  lines = iter(lines)
+  for line in lines:
+    line = line.rstrip('\n')
+    text = line.lstrip(' ')
+    indent = len(line) - len(text)
+    if not text:
+      yield indent, None, '', ''
+      continue
+    field, sep, value = text.partition(':')
+    if not sep or field not in FIELDS:
+      yield indent, '', text, text
+      continue
+    value = value.lstrip(' ')
+    if field == 'Description':
+      while len(value) < 2 or value[-1] != '"':
+        line = next(lines, None)
+        if line is None:
+          break
+        value += '\n' + line.rstrip('\n')[indent:]
+    yield indent, field, value, text
+
+
+# Inverse of get_version, '5.0' becomes a grammarVersion dict
+def parse_version(text: str) -> dict:
+  major, _, minor = text.partition('.')
+  return {'major': int(major or 0), 'minor': int(minor or 0), 'patch': 0}
+
+
+# Splits a leading 'min..max' cardinality off text, None without one
+def split_range(text: str):
+  word = text.partition(' ')[0]
+  low, sep, high = word.partition('..')
+  if not sep or not low.isdigit() or not (high.isdigit() or high == '*'):
+    return None
+  high = int(high) if high != '*' else high
+  return int(low), high, text[len(word):].lstrip(' ')
+
+
+def is_tbd(text: str) -> bool:
+  return text.startswith('TBD "') and text.endswith('"')
+
+
+# Url of a standardhealthrecord.org value set or codesystem, these are
+# written without their url so only the namespace and name are known
+def shr_url(namespace: str, kind: str, name: str='') -> str:
+  path = namespace[4:] if namespace.startswith('shr.') else namespace
+  return '{0}{1}/{2}/{3}'.format(SHR_URL, path, kind, name)
+
+
+# Namespace of the file being read, with the namespaces it uses and the
+# codesystem abbreviations in its header
+class Scope:
+  __slots__ = ('namespace', 'uses', 'codesystems')
+
+  def __init__(self):
+    self.namespace = ''
+    self.uses = []
+    self.codesystems = dict()
+
+
+# Reads Cameo text written by JsonToCameo back into the json it converts.
+# Files are read line by line, references to elements and value sets in
+# other files are resolved once every file is read.
+class CameoImporter:
+
+  def __init__(self, codesystems: CodeSystemRegistry=None):
+    # Abbreviations read from the text are added to the registry
+    self.codesystems = codesystems if codesystems is not None else (
+        CodeSystemRegistry())
+    self.namespaces = []
+    self.value_sets = []
+    # Urls of every abbreviation in the headers, in the order first read
+    self.abbreviations = dict()
+    # Namespaces defining each element label and value set label
+    self.elements = defaultdict(list)
+    self.value_set_namespaces = dict()
+    # (identifier, scope) and (constraint, value set, scope) to resolve
+    self.identifiers = []
+    self.value_set_refs = []
+    self.unresolved = set()
+    # (label, namespace) of references that several namespaces could define
+    self.ambiguous = set()
+
+  # Reads every .txt file in a directory, or a single file
+  def read_path(self, path: str) -> None:
+    if os.path.isdir(path):
+      for name in sorted(os.listdir(path)):
+        if name.endswith('.txt'):
+          self.read_file(os.path.join(path, name))
+    else:
+      self.read_file(path)
+
+  def read_file(self, filename: str) -> None:
+    with open(filename, 'r') as cameo_file:
+      self.read(cameo_file, filename)
+
+  # Reads the lines of one DataElement or ValueSet file
+  def read(self, lines, name: str='') -> None:
+    tokens = tokenize(lines)
+    for indent, field, value, text in tokens:
+      if field is None:
+        continue
+      if field != 'Grammar':
+        raise Exception('{0} is missing its Grammar'.format(name))
+      grammar, _, version = value.partition(' ')
+      break
+    else:
+      raise Exception('{0} is empty'.format(name))
+    if grammar == 'DataElement':
+      self.read_namespace(tokens, parse_version(version))
+    elif grammar == 'ValueSet':
+      self.read_value_sets(tokens, parse_version(version))
+    else:
+      raise Exception('{0} has unknown grammar {1}'.format(name, grammar))
+
+  # Reads the Namespace, Description, Uses and CodeSystem header fields
+  def read_header(self, field: str, value: str, scope: Scope,
+                  data: dict) -> None:
+    if field == 'Namespace':
+      scope.namespace = value
+      data['label'] = value
+    elif field == 'Description':
+      data['description'] = value[1:-1]
+    elif field == 'Uses':
+      scope.uses = value.split(', ')
+    elif field == 'CodeSystem':
+      abbrev, _, url = value.partition(' = ')
+      scope.codesystems[abbrev] = url
+      self.abbreviations.setdefault(abbrev, url)
+      self.codesystems.add(url, abbrev)
+
+  def read_namespace(self, tokens, version: dict) -> None:
+    scope = Scope()
+    namespace = {'label': '', 'type': 'Namespace', 'grammarVersion': version,
+                 'children': []}
+    element = None
+    base = 0
+    lines = []
+    for indent, field, value, text in tokens:
+      if field is None:
+        continue
+      elif field in ('Element', 'EntryElement') and not indent % DEPTH_INDENT:
+        if element is not None:
+          element['children'] = self.parse_properties(lines, scope)
+        element = self.new_element(value, field == 'EntryElement', version,
+                                   scope)
+        namespace['children'].append(element)
+        base = indent
+        lines = []
+      elif element is None:
+        self.read_header(field, value, scope, namespace)
+      elif field and indent == base:
+        self.read_field(element, field, value, scope)
+      else:
+        lines.append((indent - base, text))
+    if element is not None:
+      element['children'] = self.parse_properties(lines, scope)
+    self.namespaces.append(namespace)
+
+  def new_element(self, label: str, is_entry: bool, version: dict,
+                  scope: Scope) -> dict:
+    self.elements[label].append(scope.namespace)
+    return {
+        'type': 'DataElement',
+        'label': label,
+        'isEntry': is_entry,
+        'isAbstract': False,
+        'concepts': [],
+        'basedOn': [],
+        'grammarVersion': version,
+        'children': []
+    }
+
+  # Reads the Based on, Concept, Description and Value fields of an element
+  def read_field(self, element: dict, field: str, value: str,
+                 scope: Scope) -> None:
+    if field == 'Based on':
+      if is_tbd(value):
+        element['basedOn'].append({'type': 'TBD', 'label': value[5:-1]})
+      else:
+        element['basedOn'].append(self.identifier(value, scope))
+    elif field == 'Concept':
+      if value != 'TBD':
+        concepts = [self.code(i, scope) for i in value.split(', ')]
+        element['concepts'] = concepts
+    elif field == 'Description':
+      element['description'] = value[1:-1]
+    elif field == 'Value':
+      element['value'] = self.parse_value(value, scope)
+
+  # Parses the text after Value:, the cardinality is left out when 1..1
+  def parse_value(self, text: str, scope: Scope) -> dict:
+    if is_tbd(text):
+      return {'type': 'TBD', 'text': text[5:-1]}
+    low, high, rest = split_range(text) or (1, 1, text)
+    if rest.startswith('(') and rest.endswith(')'):
+      values = [self.parse_choice(i, scope) for i in rest[1:-1].split(' or ')]
+      return {'type': 'ChoiceValue', 'min': low, 'max': high, 'value': values}
+    value = self.parse_identifiable(rest, scope)
+    value['min'] = low
+    value['max'] = high
+    return value
+
+  def parse_choice(self, text: str, scope: Scope) -> dict:
+    if is_tbd(text):
+      return {'type': 'TBD', 'text': text[5:-1]}
+    return self.parse_identifiable(text, scope)
+
+  # Parses a label, ref(label) or constraint on a label
+  def parse_identifiable(self, text: str, scope: Scope) -> dict:
+    if text.startswith('ref(') and text.endswith(')') and ' ' not in text:
+      return {'type': 'RefValue',
+              'identifier': self.identifier(text[4:-1], scope),
+              'constraints': []}
+    constraints = []
+    label = text
+    if ' ' in text:
+      label, constraints = self.parse_constraint(text, scope)
+    return {'type': 'IdentifiableValue',
+            'identifier': self.identifier(label, scope),
+            'constraints': constraints}
+
+  # Groups the property lines of an element, a cardinality or includes
+  # constraint continues over the lines that follow it, then parses them
+  def parse_properties(self, lines: list, scope: Scope) -> list:
+    groups = []
+    for indent, text in lines:
+      if groups and not indent and groups[-1][0][0] >= CONSTRAINT_INDENT:
+        parsed = split_range(text)
+        first = split_range(groups[-1][0][1])
+        if parsed is None or first and '.' in parsed[2].partition(' ')[0]:
+          groups[-1].append((indent, text))
+          continue
+      groups.append([(indent, text)])
+    return [self.parse_property(i, scope) for i in groups]
+
+  def parse_property(self, group: list, scope: Scope) -> dict:
+    indent, text = group[0]
+    if indent >= CONSTRAINT_INDENT:
+      if split_range(text):
+        return self.parse_card(group, scope)
+      elif len(group) > 1:
+        return self.parse_includes_type(group, scope)
+      label, constraints = self.parse_constraint(text, scope)
+      return {'type': 'IdentifiableValue',
+              'identifier': self.identifier(label, scope),
+              'constraints': constraints}
+    parsed = split_range(text) if not indent else None
+    if parsed is None:
+      pieces = text.split(' or ')
+      if len(pieces) > 1:
+        values = [self.parse_choice(i, scope) for i in pieces]
+        return {'type': 'ChoiceValue', 'value': values}
+      return {'type': 'Incomplete', 'identifier': {'label': text},
+              'constraints': []}
+    low, high, rest = parsed
+    if is_tbd(rest):
+      return {'type': 'TBD', 'text': rest[5:-1], 'min': low, 'max': high}
+    pieces = rest.split(' or ')
+    if len(pieces) > 1 and all(' ' not in i or i.startswith('TBD "')
+                               for i in pieces):
+      values = [self.parse_choice(i, scope) for i in pieces]
+      return {'type': 'ChoiceValue', 'min': low, 'max': high,
+              'value': values}
+    child = self.parse_identifiable(rest, scope)
+    child['min'] = low
+    child['max'] = high
+    return child
+
+  # Parses cardinality constraints on paths of a label, each optionally
+  # followed by a constraint on the same path
+  def parse_card(self, group: list, scope: Scope) -> dict:
+    constraints = []
+    label = ''
+    for _, text in group:
+      low, high, rest = split_range(text)
+      qualified, _, sub = rest.partition(' ')
+      name, _, path = qualified.partition('.')
+      label = label or name
+      path = path.replace('.', ':')
+      constraints.append({'type': 'CardConstraint', 'min': low, 'max': high,
+                          'path': path})
+      if sub:
+        for i in self.parse_constraint(rest, scope)[1][:1]:
+          i['path'] = path
+          constraints.append(i)
+    return {'type': 'Incomplete', 'identifier': {'label': label},
+            'constraints': constraints}
+
+  # Parses includes lines, grouped under the path they constrain
+  def parse_includes_type(self, group: list, scope: Scope) -> dict:
+    constraints = []
+    label = ''
+    path = ''
+    for _, text in group:
+      if text.startswith('includes '):
+        low, high, rest = split_range(text[9:])
+        constraints.append({
+            'type': 'IncludesTypeConstraint',
+            'isA': self.identifier(rest[4:-1], scope),
+            'min': low,
+            'max': high,
+            'path': path
+        })
+      else:
+        name, _, path = text.partition('.')
+        label = label or name
+        path = path.replace('.', ':')
+    return {'type': 'Incomplete', 'identifier': {'label': label},
+            'constraints': constraints}
+
+  # Parses the constraint text written by Constraints, returns the label
+  # constrained and the constraints
+  def parse_constraint(self, text: str, scope: Scope) -> tuple:
+    label, _, rest = text.partition(' ')
+    path = ''
+    if rest.startswith(label + '.'):
+      qualified, _, rest = rest.partition(' ')
+      path = qualified[len(label) + 1:]
+    binding = None
+    if rest.startswith('from '):
+      binding, value_set = 'REQUIRED', rest[5:]
+      if value_set.endswith(' if covered'):
+        binding, value_set = 'EXTENSIBLE', value_set[:-11]
+    elif rest.startswith('should be from '):
+      binding, value_set = 'PREFERRED', rest[15:]
+    elif rest.startswith('could be from '):
+      binding, value_set = 'EXAMPLE', rest[14:]
+    if binding is not None:
+      constraint = {'type': 'ValueSetConstraint', 'bindingStrength': binding,
+                    'path': path}
+      self.value_set_refs.append((constraint, value_set, scope))
+      return label, [constraint]
+    elif rest.startswith('with units '):
+      code = self.code(rest[11:], scope)
+      return label, [{'type': 'CodeConstraint', 'code': code, 'path': ''}]
+    elif rest.startswith('is type ') or rest.startswith('value is type '):
+      constraints = []
+      for i in text.split(' or '):
+        on_value = i.partition(' ')[2].startswith('value ')
+        constraints.append({
+            'type': 'TypeConstraint',
+            'isA': self.identifier(i.rpartition(' ')[2], scope),
+            'onValue': on_value,
+            'path': ''
+        })
+      return label, constraints
+    elif rest in ('is true', 'is false'):
+      return label, [{'type': 'BooleanConstraint', 'value': rest == 'is true',
+                      'path': ''}]
+    elif rest.startswith('is '):
+      code = self.code(rest[3:], scope)
+      return label, [{'type': 'CodeConstraint', 'code': code, 'path': ''}]
+    elif rest.startswith('includes '):
+      return label, [{'type': 'IncludesCodeConstraint',
+                      'code': self.code(i, scope), 'path': ''}
+                     for i in rest[9:].split(' includes ')]
+    print('UNKNOWN_CONSTRAINT', text, scope.namespace)
+    return label, []
+
+  # Parses abbrev#code with an optional quoted display
+  def code(self, text: str, scope: Scope) -> dict:
+    abbrev, _, rest = text.partition('#')
+    code, _, display = rest.partition(' "')
+    result = {'code': code, 'system': self.system(abbrev, scope)}
+    if display:
+      result['display'] = display[:-1]
+    return result
+
+  # Returns the url of an abbreviation, standardhealthrecord.org urls are
+  # written without an abbreviation
+  def system(self, abbrev: str, scope: Scope) -> str:
+    if not abbrev:
+      return shr_url(scope.namespace, 'cs')
+    url = scope.codesystems.get(abbrev) or self.abbreviations.get(abbrev)
+    if url is None:
+      url = self.codesystems.get_url(abbrev)
+    if url is None:
+      print('UNKNOWN_CODESYSTEM', abbrev, scope.namespace)
+      self.unresolved.add(abbrev)
+    return url
+
+  # Returns an identifier whose namespace is filled in by resolve
+  def identifier(self, label: str, scope: Scope) -> dict:
+    identifier = {'label': label, 'type': 'Identifier', 'namespace': ''}
+    self.identifiers.append((identifier, scope))
+    return identifier
+
+  def read_value_sets(self, tokens, version: dict) -> None:
+    scope = Scope()
+    header = dict()
+    value_set = None
+    for indent, field, value, text in tokens:
+      if field is None:
+        continue
+      elif field == 'ValueSet':
+        value_set = {
+            'label': value,
+            'namespace': scope.namespace,
+            'type': 'ValueSet',
+            'url': shr_url(scope.namespace, 'vs', value),
+            'concepts': [],
+            'grammarVersion': version,
+            'children': []
+        }
+        self.value_sets.append(value_set)
+        self.value_set_namespaces.setdefault(value, scope.namespace)
+      elif value_set is None:
+        self.read_header(field, value, scope, header)
+      elif field == 'Concept':
+        value_set['concepts'].append(self.code(value, scope))
+      elif field == 'Description':
+        value_set['description'] = value[1:-1]
+      else:
+        value_set['children'].append(self.parse_rule(text, scope))
+
+  # Parses a value set line back into its rule
+  def parse_rule(self, text: str, scope: Scope) -> dict:
+    if text.startswith(DESCENDENTS):
+      rule = 'ValueSetIncludesDescendentsRule'
+      code = self.code(text[len(DESCENDENTS):], scope)
+    elif text.startswith(FROM_CODES) and '#' in text:
+      rule = 'ValueSetIncludesFromCodeRule'
+      code = self.code(text[len(FROM_CODES):], scope)
+    elif text.startswith(FROM_CODES):
+      return {'type': 'ValueSetIncludesFromCodeSystemRule', 'label': '',
+              'system': self.system(text[len(FROM_CODES):], scope)}
+    else:
+      rule = 'ValueSetIncludesCodeRule'
+      abbrev, _, rest = text.partition('#')
+      quote = rest.find('"')
+      code = {'code': rest[:quote].rstrip(' '),
+              'system': self.system(abbrev, scope),
+              'display': rest[quote + 1:-1]}
+    label = code.pop('display', '')
+    code['label'] = label
+    return {'type': rule, 'label': label, 'code': code}
+
+  # Fills in the namespaces of identifiers and the urls of value sets now
+  # that every file is read
+  def resolve(self) -> None:
+    for identifier, scope in self.identifiers:
+      identifier['namespace'] = self.find_namespace(identifier['label'],
+                                                    scope)
+    for constraint, value_set, scope in self.value_set_refs:
+      constraint['valueset'] = self.value_set_url(value_set, scope)
+    self.identifiers = []
+    self.value_set_refs = []
+
+  # Prefers an element's own namespace, then the namespaces it uses. Uses
+  # are written in no particular order, so when several define the label
+  # the first by name is picked and the reference is noted as ambiguous.
+  def find_namespace(self, label: str, scope: Scope) -> str:
+    namespaces = self.elements.get(label)
+    if namespaces:
+      if scope.namespace in namespaces:
+        return scope.namespace
+      candidates = sorted(i for i in scope.uses if i in namespaces)
+      if not candidates:
+        candidates = namespaces
+      if len(candidates) > 1:
+        self.ambiguous.add((label, scope.namespace))
+      return candidates[0]
+    elif label[:1].islower():
+      return 'primitive'
+    self.unresolved.add(label)
+    return ''
+
+  def value_set_url(self, value_set: str, scope: Scope) -> str:
+    if value_set.startswith('TBD "'):
+      return TBD_VALUE_SET + value_set[5:-1]
+    elif ':' in value_set:
+      return value_set
+    namespace = self.value_set_namespaces.get(value_set, scope.namespace)
+    return shr_url(namespace, 'vs', value_set)
+
+  # Returns the spec json for everything read so far
+  def to_json(self) -> dict:
+    self.resolve()
+    urls = list(dict.fromkeys(self.abbreviations.values()))
+    return {
+        'label': 'SHR',
+        'type': 'SHR',
+        'children': [{
+            'label': 'Namespaces',
+            'type': 'Namespaces',
+            'children': self.namespaces
+        }, {
+            'label': 'Value Sets',
+            'type': 'ValueSets',
+            'children': self.value_sets
+        }, {
+            'label': 'Code Systems',
+            'type': 'CodeSystems',
+            'children': [{'type': 'CodeSystem', 'url': i} for i in urls]
+        }]
+    }
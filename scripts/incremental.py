@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+
+from scripts.codesystems import CodeSystems
+from scripts.graph import DependencyGraph
+from scripts.namespace import Namespace, Namespaces
+from scripts.output import namespace_filename, value_set_filename
+from scripts.output import write_json_atomic
+from scripts.value_sets import ValueSet, ValueSets
+
+MANIFEST = '.json2cameo_manifest.json'
+# Bump whenever rendering changes so old manifests stop matching
+MANIFEST_VERSION = 2
+
+
+# Hashes a json subtree independent of key order
+def content_hash(data) -> str:
+  text = json.dumps(data, sort_keys=True, separators=(',', ':'))
+  return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# Hashes the abbreviations of the codesystems an output depends on
+def codesystem_hash(lookups: list) -> str:
+  return content_hash([[i, CodeSystems.get(i)] for i in lookups])
+
+
+# Per namespace and valueset namespace hashes stored in the output directory
+class Manifest:
+
+  def __init__(self, output: str):
+    self.path = os.path.join(output, MANIFEST)
+    self.namespaces = dict()
+    self.value_sets = dict()
+    if os.path.exists(self.path):
+      with open(self.path, 'r') as manifest_file:
+        data = json.load(manifest_file)
+      if data.get('version') == MANIFEST_VERSION:
+        self.namespaces = data.get('namespaces', {})
+        self.value_sets = data.get('value_sets', {})
+
+  # Writes the manifest atomically so an interrupted run can't corrupt it
+  def save(self) -> None:
+    data = {
+        'version': MANIFEST_VERSION,
+        'namespaces': self.namespaces,
+        'value_sets': self.value_sets
+    }
+    write_json_atomic(self.path, data)
+
+
+# Builds a model while recording the codesystems it looks up, namespaces
+# that fail to parse are reported and skipped like Namespaces does
+def build_recorded(cls, data: dict) -> tuple:
+  CodeSystems.start_recording()
+  try:
+    model = cls(data)
+  except Exception as e:
+    if cls is not Namespace:
+      raise
+    print('PARSE_ERROR', data['label'], e)
+    model = None
+  finally:
+    lookups = CodeSystems.stop_recording()
+  return model, lookups
+
+
+# Rebuilds only the namespaces and valueset namespaces whose json or
+# codesystem abbreviations changed since the manifest was written.
+# Lookups of unchanged subtrees are replayed in document order so new
+# abbreviations are minted exactly as in a full conversion. The Uses of
+# every namespace are kept in the manifest, so the namespaces depending
+# on changed ones are known without parsing them.
+class IncrementalBuild:
+
+  def __init__(self, namespaces: dict, value_sets: dict, output: str):
+    self.output = output
+    self.old = Manifest(output)
+    self.manifest = Manifest(output)
+    self.manifest.namespaces = dict()
+    self.manifest.value_sets = dict()
+    self.namespaces = Namespaces({'label': namespaces.get('label', ''),
+                                  'type': namespaces.get('type', '')})
+    self.value_sets = ValueSets({})
+    self.skipped = []
+    # Namespaces whose json changed, was added or was removed
+    self.changed = []
+    ns_children = self.parse_namespaces(namespaces.get('children', []))
+    vs_groups = self.parse_value_sets(value_sets.get('children', []))
+    self.rebuild_dependents(ns_children, vs_groups)
+    self.changed.extend(i for i in self.old.namespaces if i not in ns_children)
+    self.graph = DependencyGraph({i: self.manifest.namespaces[i]['uses']
+                                  for i in self.manifest.namespaces})
+
+  def parse_namespaces(self, children: list) -> dict:
+    by_label = dict()
+    for child in children:
+      label = child.get('label', '')
+      by_label[label] = child
+      digest = content_hash(child)
+      old = self.old.namespaces.get(label)
+      if old is not None and old['hash'] == digest:
+        CodeSystems.replay(old['lookups'])
+        self.manifest.namespaces[label] = dict(old)
+        continue
+      self.changed.append(label)
+      n, lookups = build_recorded(Namespace, child)
+      if n is not None:
+        self.namespaces.namespaces[n.label] = n
+      self.manifest.namespaces[label] = {
+          'hash': digest,
+          'lookups': lookups,
+          'parsed': n is not None,
+          'uses': sorted(n.uses) if n is not None else []
+      }
+    return by_label
+
+  def parse_value_sets(self, children: list) -> dict:
+    groups = dict()
+    for child in children:
+      groups.setdefault(child.get('namespace', ''), []).append(child)
+    digests = {i: content_hash(groups[i]) for i in groups}
+    positions = dict()
+    for child in children:
+      namespace = child.get('namespace', '')
+      position = positions.get(namespace, 0)
+      positions[namespace] = position + 1
+      old = self.old.value_sets.get(namespace)
+      if old is not None and old['hash'] == digests[namespace]:
+        CodeSystems.replay(old['lookups'][position])
+        self.manifest.value_sets[namespace] = dict(old)
+        continue
+      vs, lookups = build_recorded(ValueSet, child)
+      self.value_sets.add(vs)
+      entry = self.manifest.value_sets.setdefault(namespace, {
+          'hash': digests[namespace],
+          'lookups': []
+      })
+      entry['lookups'].append(lookups)
+    return groups
+
+  # Once every abbreviation is final, unchanged outputs whose codesystems
+  # were re-abbreviated or whose files are missing are rebuilt as well
+  def rebuild_dependents(self, ns_children: dict, vs_groups: dict) -> None:
+    for label, entry in self.manifest.namespaces.items():
+      digest = codesystem_hash(entry['lookups'])
+      unchanged = entry.get('codesystems') == digest
+      entry['codesystems'] = digest
+      if label in self.namespaces.namespaces or not entry['parsed']:
+        continue
+      filename = namespace_filename(label)
+      if unchanged and os.path.exists(os.path.join(self.output, filename)):
+        self.skipped.append(filename)
+        continue
+      self.namespaces.parse_namespaces([ns_children[label]])
+
+    for namespace, entry in self.manifest.value_sets.items():
+      lookups = [i for group in entry['lookups'] for i in group]
+      digest = codesystem_hash(lookups)
+      unchanged = entry.get('codesystems') == digest
+      entry['codesystems'] = digest
+      if namespace in self.value_sets.value_sets:
+        continue
+      filename = value_set_filename(namespace)
+      if unchanged and os.path.exists(os.path.join(self.output, filename)):
+        self.skipped.append(filename)
+        continue
+      self.value_sets.parse_children(vs_groups[namespace])
@@ -1,7 +1,11 @@
+import io
 from collections import defaultdict
+from collections.abc import MutableMapping
 
-from scripts.codesystems import CodeSystems
-from scripts.constraints import Constraints
+from scripts import profiling, symbols
+from scripts.codesystems import CodeSystems, get_registry, use_registry
+from scripts.constraints import Constraints, EMPTY_CODESYSTEMS, EMPTY_USES
+from scripts.selection import Selection, is_selected
 
 
 # Formats version based on major, minor, and patch values
@@ -10,19 +14,42 @@ def get_version(version_dict):
   minor = version_dict.get('minor', 0)
   patch = version_dict.get('patch', 0)
   # return '{}.{}.{}'.format(major, minor, patch)
-  return '{}.{}'.format(major, minor)
+  return symbols.intern('{}.{}'.format(major, minor))
+
+
+# Joins (depth, text) segments into lines, nested definitions are indented
+# here rather than re-split at every level
+def join_segments(segments: list) -> str:
+  return '\n'.join(indent_segment(d, t) for d, t in segments)
+
+
+# Writes (depth, text) segments to a stream one at a time
+def write_segments(stream, segments: list) -> None:
+  for i, (depth, text) in enumerate(segments):
+    if i:
+      stream.write('\n')
+    stream.write(indent_segment(depth, text))
+
+
+def indent_segment(depth: int, text: str) -> str:
+  if not depth:
+    return text
+  indent = ' ' * (10 * depth)
+  return indent + text.replace('\n', '\n' + indent)
 
 
 class IdentifiableValue:
+  __slots__ = ('is_ref', 'no_range', 'min', 'max', 'label', 'namespace',
+               'constraint', 'codesystems', 'uses')
 
   def __init__(self, value: dict, is_ref=False):
     self.is_ref = is_ref
     self.no_range = 'min' not in value and 'max' not in value
-    self.min = str(value.get('min', 0))
-    self.max = str(value.get('max', '*'))
+    self.min = symbols.intern(str(value.get('min', 0)))
+    self.max = symbols.intern(str(value.get('max', '*')))
     identifier = value.get('identifier', {})
-    self.label = identifier.get('label', '')
-    self.namespace = identifier.get('namespace', '')
+    self.label = symbols.intern(identifier.get('label', ''))
+    self.namespace = symbols.intern(identifier.get('namespace', ''))
     constraint = Constraints(value.get('constraints', []), self.label)
     self.constraint = str(constraint)
     self.codesystems = constraint.codesystems
@@ -55,14 +82,15 @@ class IdentifiableValue:
 
 
 class ChildTBD:
+  __slots__ = ('text', 'no_range', 'min', 'max')
+  codesystems = EMPTY_CODESYSTEMS
+  uses = EMPTY_USES
 
   def __init__(self, value: dict):
     self.text = value.get('text', '')
     self.no_range = 'min' not in value and 'max' not in value
-    self.min = str(value.get('min', 0))
-    self.max = str(value.get('max', '*'))
-    self.codesystems = dict()
-    self.uses = set()
+    self.min = symbols.intern(str(value.get('min', 0)))
+    self.max = symbols.intern(str(value.get('max', '*')))
 
   def to_string_value(self) -> str:
     if self.text:
@@ -78,12 +106,14 @@ class ChildTBD:
 
 
 class Incomplete:
+  __slots__ = ('label', 'no_range', 'min', 'max', 'constraint', 'codesystems',
+               'uses')
 
   def __init__(self, value: dict):
-    self.label = value.get('identifier', {}).get('label', '')
+    self.label = symbols.intern(value.get('identifier', {}).get('label', ''))
     self.no_range = 'min' not in value and 'max' not in value
-    self.min = str(value.get('min', 0))
-    self.max = str(value.get('max', '*'))
+    self.min = symbols.intern(str(value.get('min', 0)))
+    self.max = symbols.intern(str(value.get('max', '*')))
     constraint = Constraints(value.get('constraints', []), self.label)
     self.constraint = str(constraint)
     self.codesystems = constraint.codesystems
@@ -102,29 +132,38 @@ class Incomplete:
 
 
 class ChoiceValue:
+  __slots__ = ('no_range', 'min', 'max', 'elements', 'namespaces',
+               'codesystems', 'uses', 'values')
 
   def __init__(self, value: dict):
     self.no_range = 'min' not in value and 'max' not in value
-    self.min = str(value.get('min', 0))
-    self.max = str(value.get('max', '*'))
+    self.min = symbols.intern(str(value.get('min', 0)))
+    self.max = symbols.intern(str(value.get('max', '*')))
     self.elements = defaultdict(list)
     self.namespaces = set()
-    self.codesystems = dict()
-    self.uses = set()
+    self.codesystems = EMPTY_CODESYSTEMS
+    self.uses = EMPTY_USES
     self.values = self.build_values(value.get('value', []))
 
   def build_values(self, vs: list) -> list:
     values = []
     for value in vs:
-      label = value.get('identifier', {}).get('label', '')
-      namespace = value.get('identifier', {}).get('namespace', '')
+      identifier = value.get('identifier', {})
+      label = symbols.intern(identifier.get('label', ''))
+      namespace = symbols.intern(identifier.get('namespace', ''))
       if namespace:
         self.namespaces.add(namespace)
       v_type = value.get('type')
       c = Constraints(value.get('constraints', []), label)
       constraint = str(c)
-      self.codesystems.update(c.codesystems)
-      self.uses.update(c.uses)
+      if c.codesystems:
+        if self.codesystems is EMPTY_CODESYSTEMS:
+          self.codesystems = dict()
+        self.codesystems.update(c.codesystems)
+      if c.uses:
+        if self.uses is EMPTY_USES:
+          self.uses = set()
+        self.uses.update(c.uses)
       if constraint:
         values.append(constraint)
       elif v_type == 'RefValue':
@@ -159,7 +198,7 @@ class DataElement:
   def __init__(self, data_element: dict, namespace: str):
     self.is_defined = False
     self.namespace = namespace
-    self.label = data_element.get('label', '')
+    self.label = symbols.intern(data_element.get('label', ''))
     self.codesystems = dict()
     self.uses = set()
     self.concepts = self.build_concepts(data_element.get('concepts', []))
@@ -179,52 +218,53 @@ class DataElement:
       data_element.is_defined = True
       self.definitions.append(data_element.label)
 
-  # Parse children for each sub element, pass in all data elements
+  # Parse children for each sub element using the namespace index
   # MUST BE RUN BEFORE STR OF DATA ELEMENT IS USED
-  def parse_children(self, elements: dict) -> None:
-    for child in self.children:
-      c_type = child.get('type')
-      if c_type == 'IdentifiableValue':
-        new_child = IdentifiableValue(child)
-        self.properties.append(str(new_child))
-        if new_child.constraint:
-          for c in child.get('constraints', []):
-            if c.get('type', '') == 'TypeConstraint':
-              name = c.get('isA', {}).get('_name', '')
-              namespace = c.get('isA', {}).get('_namespace', '')
-              if name and namespace == self.namespace:
-                self.update_definitions(elements, name)
-        if new_child.namespace == self.namespace:
-          self.update_definitions(elements, new_child.label)
-        else:
-          self.uses.add(new_child.namespace)
-      elif c_type == 'TBD':
-        new_child = ChildTBD(child)
-        self.properties.append(str(new_child))
-      elif c_type == 'ChoiceValue':
-        new_child = ChoiceValue(child)
-        for namespace in new_child.elements:
-          if namespace == self.namespace:
-            for label in new_child.elements[namespace]:
-              self.update_definitions(elements, label)
+  def parse_children(self, index: 'ElementIndex') -> None:
+    with profiling.timer('parse_children', self.namespace):
+      elements = index.elements
+      type_refs = index.type_refs.get(self.label, [])
+      for position, child in enumerate(self.children):
+        c_type = child.get('type')
+        if c_type == 'IdentifiableValue':
+          new_child = IdentifiableValue(child)
+          self.properties.append(str(new_child))
+          if new_child.constraint:
+            for name in type_refs[position]:
+              self.update_definitions(elements, name)
+          if new_child.namespace == self.namespace:
+            self.update_definitions(elements, new_child.label)
+          else:
+            self.uses.add(new_child.namespace)
+        elif c_type == 'TBD':
+          new_child = ChildTBD(child)
+          self.properties.append(str(new_child))
+        elif c_type == 'ChoiceValue':
+          new_child = ChoiceValue(child)
+          for namespace in new_child.elements:
+            if namespace == self.namespace:
+              for label in new_child.elements[namespace]:
+                self.update_definitions(elements, label)
+            else:
+              self.uses.add(namespace)
+          self.properties.append(str(new_child))
+        elif c_type == 'RefValue':
+          new_child = IdentifiableValue(child, is_ref=True)
+          self.properties.append(str(new_child))
+          if new_child.namespace == self.namespace:
+            self.update_definitions(elements, new_child.label)
           else:
-            self.uses.add(namespace)
-        self.properties.append(str(new_child))
-      elif c_type == 'RefValue':
-        new_child = IdentifiableValue(child, is_ref=True)
-        self.properties.append(str(new_child))
-        if new_child.namespace == self.namespace:
-          self.update_definitions(elements, new_child.label)
+            self.uses.add(new_child.namespace)
+        # TODO Update when fixed
+        elif c_type == 'Incomplete':
+          new_child = Incomplete(child)
+          self.properties.append(str(new_child))
         else:
-          self.uses.add(new_child.namespace)
-      # TODO Update when fixed
-      elif c_type == 'Incomplete':
-        new_child = Incomplete(child)
-        self.properties.append(str(new_child))
-      else:
-        print('STATUS', c_type, child.get('label'), self.namespace)
-      self.codesystems.update(new_child.codesystems)
-      self.uses.update(new_child.uses)
+          print('STATUS', c_type, child.get('label'), self.namespace)
+          profiling.count('status', c_type)
+        self.codesystems.update(new_child.codesystems)
+        self.uses.update(new_child.uses)
+      self.children = []
 
   # Build concept list
   def build_concepts(self, concepts: list) -> list:
@@ -234,19 +274,10 @@ class DataElement:
       system = concept.get('system', '')
       abbrev = CodeSystems.get(system)
       if len(system) and len(abbrev):
-        self.codesystems[system] = abbrev
+        self.codesystems[CodeSystems.canonical(system)] = abbrev
       cs.append('{0}#{1}'.format(abbrev, code))
-    return '{0:20}{1}'.format('Concept:', ', '.join(cs) if cs else 'TBD')
-
-  # Builds the children of a data element
-  def build_definitions(self, elements: dict) -> str:
-    all_definitions = []
-    for label in self.definitions:
-      data_element_str = elements[label].to_string(elements)
-      lines = data_element_str.split('\n')
-      definition = '\n'.join(l.rjust(len(l) + 10) for l in lines)
-      all_definitions.append(definition)
-    return '\n\n'.join(all_definitions)
+    return symbols.intern('{0:20}{1}'.format('Concept:',
+                                             ', '.join(cs) if cs else 'TBD'))
 
   # Builds line for data elements based on others
   def build_based_on(self, based_on: list) -> str:
@@ -256,8 +287,8 @@ class DataElement:
       values.append(text.format('Based on:', i.get('label', '')))
       namespace = i.get('namespace', '')
       if namespace and namespace != self.namespace:
-        self.uses.add(namespace)
-    return '\n'.join(values)
+        self.uses.add(symbols.intern(namespace))
+    return symbols.intern('\n'.join(values))
 
   def build_description(self) -> str:
     if self.description:
@@ -271,7 +302,7 @@ class DataElement:
     label = value.get('identifier', {}).get('label', '')
     namespace = value.get('identifier', {}).get('namespace', '')
     if namespace:
-      self.uses.add(namespace)
+      self.uses.add(symbols.intern(namespace))
     constraint = Constraints(value.get('constraints', []), label)
     constraint_string = str(constraint)
     self.codesystems.update(constraint.codesystems)
@@ -297,8 +328,8 @@ class DataElement:
       else:
         return ''
 
-  # Converts data element to string
-  def to_string(self, elements: dict) -> str:
+  # Builds the element's own lines, without its definitions
+  def build_text(self) -> str:
     title_text = 'EntryElement:' if self.is_entry else 'Element:'
     title = '{0:20}{1}'.format(title_text, self.label)
     concept = self.concepts
@@ -307,23 +338,166 @@ class DataElement:
     # TODO finish value
     value = self.value
     properties = '\n'.join(self.properties)
-    definitions = self.build_definitions(elements)
     output = [title, based_on, concept, description, value, properties]
-    output_def = (filter(None, ['\n'.join(filter(None, output)), definitions]))
-    return '\n\n'.join(output_def)
+    return '\n'.join(filter(None, output))
+
+  # Renders the data element and its definitions as (depth, text) segments,
+  # cached per label and depth so each element is only rendered once.
+  # Definitions are walked with an explicit stack so any nesting depth
+  # works, and a definition of an element already being rendered above it
+  # is a cycle and left out.
+  def render(self, elements: dict, depth: int=0, cache: dict=None) -> list:
+    if cache is None:
+      cache = dict()
+    key = (self.label, depth)
+    if key in cache:
+      return cache[key]
+    # Elements being rendered with their segments so far and the rest of
+    # their definitions. Frames below uncached were open when a cycle was
+    # left out, so their output depends on the path and isn't cached.
+    stack = [(self, depth, [(depth, self.build_text())],
+              iter(self.definitions))]
+    path = {self.label}
+    uncached = 0
+    while stack:
+      element, element_depth, segments, definitions = stack[-1]
+      for label in definitions:
+        if label in path:
+          profiling.count('definition_cycle', label)
+          uncached = len(stack)
+          continue
+        key = (label, element_depth + 1)
+        if key in cache:
+          segments.append((element_depth, ''))
+          segments.extend(cache[key])
+          continue
+        child = elements[label]
+        path.add(label)
+        stack.append((child, element_depth + 1,
+                      [(element_depth + 1, child.build_text())],
+                      iter(child.definitions)))
+        break
+      else:
+        stack.pop()
+        path.discard(element.label)
+        if len(stack) >= uncached:
+          cache[(element.label, element_depth)] = segments
+        uncached = min(uncached, len(stack))
+        if stack:
+          parent_depth, parent_segments = stack[-1][1:3]
+          parent_segments.append((parent_depth, ''))
+          parent_segments.extend(segments)
+    return segments
+
+  # Converts data element to string
+  def to_string(self, elements: dict, cache: dict=None) -> str:
+    return join_segments(self.render(elements, 0, cache))
+
+  # Writes the data element and its definitions to a stream
+  def write_to(self, stream, elements: dict, cache: dict=None) -> None:
+    write_segments(stream, self.render(elements, 0, cache))
+
+
+# Single pass index of the data elements in a namespace and the labels
+# their children reference, keyed by the referencing child type
+class ElementIndex:
+
+  def __init__(self, namespace: str):
+    self.namespace = namespace
+    self.elements = dict()
+    self.parents = defaultdict(list)
+    self.references = defaultdict(lambda: defaultdict(list))
+    # Same namespace TypeConstraint labels for each child of an element
+    self.type_refs = dict()
+
+  # Identifies all data elements and identifiable values, depth first in
+  # document order. Nested children are walked with an explicit stack of
+  # (children, parent) iterators so any nesting depth works.
+  def add(self, children: list, parent: str=None) -> None:
+    stack = [(iter(children), parent)]
+    while stack:
+      children, parent = stack[-1]
+      child = next(children, None)
+      if child is None:
+        stack.pop()
+        continue
+      nested_children = []
+      label = ''
+      labels = []
+
+      child_type = child.get('type', '')
+      constraints = child.get('constraints', [])
+      if child_type == 'DataElement':
+        label = symbols.intern(child.get('label', ''))
+        self.elements[label] = DataElement(child, self.namespace)
+        nested_children = child.get('children', [])
+        self.type_refs[label] = [self.get_type_refs(i)
+                                 for i in nested_children]
+
+        # TODO Figure out data elements within children
+        # LOOK AT ENCOUNTER
+      elif child_type == 'IdentifiableValue' or child_type == 'RefValue':
+        if len(constraints) and constraints[0].get('type') == 'TypeConstraint':
+          child_type = 'TypeConstraint'
+          for i in constraints:
+            labels.append(symbols.intern(i.get('isA', {}).get('_name', '')))
+        else:
+          label = symbols.intern(child.get('identifier', {}).get('label', ''))
+      elif child_type == 'ChoiceValue':
+        for c in child.get('value', []):
+          identifier = c.get('identifier', {})
+          labels.append(symbols.intern(identifier.get('label', '')))
+
+      if parent is not None:
+        for i in filter(None, labels + [label]):
+          self.parents[i].append(parent)
+          self.references[parent][child_type].append(i)
+
+      if label and nested_children:
+        stack.append((iter(nested_children), label))
+
+  # Labels of TypeConstraints on a child that are defined in this namespace
+  def get_type_refs(self, child: dict) -> list:
+    refs = []
+    for c in child.get('constraints', []):
+      if c.get('type', '') == 'TypeConstraint':
+        name = c.get('isA', {}).get('_name', '')
+        namespace = c.get('isA', {}).get('_namespace', '')
+        if name and namespace == self.namespace:
+          refs.append(symbols.intern(name))
+    return refs
+
+  # Returns the data element with a label, or None
+  def get(self, label: str):
+    return self.elements.get(label)
+
+  # Returns the labels of the elements whose children reference a label
+  def referenced_by(self, label: str) -> list:
+    return self.parents.get(label, [])
+
+  # Returns the labels an element references, optionally of one child type
+  def references_of(self, label: str, kind: str=None) -> list:
+    references = self.references.get(label, {})
+    if kind is not None:
+      return references.get(kind, [])
+    return [i for k in references for i in references[k]]
 
 
 class Namespace:
 
   def __init__(self, namespace):
-    self.label = namespace.get('label', '')
-    self.description = namespace.get('description', '')
-    self.version = get_version(namespace.get('grammarVersion', {}))
-    self.uses = set()
-    self.data_elements = dict()
-    self.child_to_parent = defaultdict(list)
-    self.populate_master_lists(namespace.get('children', []))
-    self.base_elements = self.get_base_elements()
+    with profiling.timer('namespace', namespace.get('label', '')):
+      self.label = symbols.intern(namespace.get('label', ''))
+      self.description = namespace.get('description', '')
+      self.version = get_version(namespace.get('grammarVersion', {}))
+      self.uses = set()
+      # Rendered data element segments keyed by label and depth
+      self.render_cache = dict()
+      self.index = ElementIndex(self.label)
+      self.index.add(namespace.get('children', []))
+      self.data_elements = self.index.elements
+      self.child_to_parent = self.index.parents
+      self.base_elements = self.get_base_elements()
 
   #  Builds codesystems by looking through all the elements
   def build_codesystems(self) -> str:
@@ -354,86 +528,211 @@ class Namespace:
   def build_body(self) -> str:
     elems = []
     for i in self.base_elements:
-      elems.append(self.data_elements[i].to_string(self.data_elements))
+      element = self.data_elements[i]
+      elems.append(element.to_string(self.data_elements, self.render_cache))
     return '\n\n\n'.join(elems)
 
-  # Identifies all data elements and identifiable values
-  def populate_master_lists(self, children: list, parent: str=None) -> None:
-    for child in children:
-      nested_children = []
-      label = ''
-      labels = []
-
-      child_type = child.get('type', '')
-      constraints = child.get('constraints', [])
-      if child_type == 'DataElement':
-        label = child.get('label', '')
-        self.data_elements[label] = DataElement(child, self.label)
-        nested_children = child.get('children', [])
-
-        # TODO Figure out data elements within children
-        # LOOK AT ENCOUNTER
-        # child_value_type = child.get('value', {}).get('type', '')
-        # cvn = child.get('value', {}).get('identifier', {}).get('namespace', '')
-        # if child_value_type == 'IdentifiableValue' and cvn == self.label:
-        #   print(child.get('value').get('label'))
-        #   self.populate_master_lists([child.get('value', {})], label)
-      elif child_type == 'IdentifiableValue' or child_type == 'RefValue':
-        if len(constraints) and constraints[0].get('type') == 'TypeConstraint':
-          for i in constraints:
-            labels.append(i.get('isA', {}).get('_name', ''))
-        else:
-          label = child.get('identifier', {}).get('label', '')
-      elif child_type == 'ChoiceValue':
-        for c in child.get('value', []):
-          labels.append(c.get('identifier', {}).get('label', ''))
-
-      if labels and parent is not None:
-        for label in (filter(None, labels)):
-          self.child_to_parent[label].append(parent)
-      if label and parent is not None:
-        self.child_to_parent[label].append(parent)
-
-      if label and nested_children:
-        self.populate_master_lists(nested_children, label)
-
   # Returns base elements parses children for future use
   def get_base_elements(self) -> list:
     base_elems = []
     for i in self.data_elements:
       element = self.data_elements[i]
-      if len(self.child_to_parent[element.label]) == 0:
+      if not self.index.referenced_by(element.label):
         # Prevents elements from being defined in other data elements
         element.is_defined = True
         base_elems.append(element.label)
       # Prepares children so they aren't defined in multiple places
-      element.parse_children(self.data_elements)
+      element.parse_children(self.index)
       self.uses.update(element.uses)
     for i in ['primitive', self.label]:
       if i in self.uses:
         self.uses.remove(i)
     return base_elems
 
-  def __str__(self):
-    header = self.build_header()
+  # Writes the namespace to a stream one data element at a time
+  def write_to(self, stream) -> None:
+    stream.write(self.build_header())
     codesystems = self.build_codesystems()
-    body = self.build_body()
-    return '\n\n'.join(filter(None, [header, codesystems, body]))
+    if codesystems:
+      stream.write('\n\n')
+      stream.write(codesystems)
+    for i, label in enumerate(self.base_elements):
+      stream.write('\n\n\n' if i else '\n\n')
+      element = self.data_elements[label]
+      element.write_to(stream, self.data_elements, self.render_cache)
+
+  def __str__(self):
+    output = io.StringIO()
+    self.write_to(output)
+    return output.getvalue()
+
+
+# Builds a namespace, reporting it and returning None when it doesn't parse
+def parse_namespace(name: dict):
+  try:
+    return Namespace(name)
+  except Exception as e:
+    print('PARSE_ERROR', name['label'], e)
+    profiling.count('parse_error', name['label'])
+    return None
+
+
+# Looks up the codesystems building a namespace would, in the same order,
+# without building it: each data element's concepts and value as elements
+# are indexed, then the children of each element. Stops where the build
+# fails, at the first child referencing an element the namespace lacks.
+def look_up_namespace(namespace: dict) -> None:
+  label = namespace.get('label', '')
+  elements = dict()
+  stack = [iter(namespace.get('children', []))]
+  try:
+    while stack:
+      child = next(stack[-1], None)
+      if child is None:
+        stack.pop()
+        continue
+      if child.get('type', '') != 'DataElement':
+        continue
+      elements[child.get('label', '')] = child
+      look_up_element(child)
+      if child.get('label', '') and child.get('children', []):
+        stack.append(iter(child.get('children', [])))
+    for element in elements.values():
+      if not look_up_children(element, elements, label):
+        return
+  except Exception:
+    return
+
+
+# Lookups of a data element's concepts and value
+def look_up_element(element: dict) -> None:
+  for concept in element.get('concepts', []):
+    CodeSystems.get(concept.get('system', ''))
+  value = element.get('value', {})
+  if value:
+    Constraints(value.get('constraints', [])).look_up()
+    if value.get('type') == 'ChoiceValue':
+      for choice in value.get('value', []):
+        Constraints(choice.get('constraints', [])).look_up()
+
+
+# Lookups of a data element's children, returns False at the first child
+# that would fail to parse
+def look_up_children(element: dict, elements: dict, namespace: str) -> bool:
+  parsed = False
+  for child in element.get('children', []):
+    c_type = child.get('type')
+    identifier = child.get('identifier', {})
+    if c_type in ('IdentifiableValue', 'RefValue'):
+      if Constraints(child.get('constraints', [])).look_up():
+        if c_type == 'IdentifiableValue' and not all(
+            i in elements for i in type_refs(child, namespace)):
+          return False
+      if (identifier.get('namespace', '') == namespace and
+          identifier.get('label', '') not in elements):
+        return False
+    elif c_type == 'ChoiceValue':
+      labels = []
+      for choice in child.get('value', []):
+        rendered = Constraints(choice.get('constraints', [])).look_up()
+        choice_id = choice.get('identifier', {})
+        if (not rendered and choice.get('type') != 'TBD' and
+            choice_id.get('namespace', '') == namespace):
+          labels.append(choice_id.get('label', ''))
+      if not all(i in elements for i in labels):
+        return False
+    elif c_type == 'Incomplete':
+      Constraints(child.get('constraints', [])).look_up()
+    elif c_type != 'TBD' and not parsed:
+      # An unknown first child has no model for parse_children to merge
+      return False
+    parsed = parsed or c_type in ('IdentifiableValue', 'RefValue', 'TBD',
+                                  'ChoiceValue', 'Incomplete')
+  return True
+
+
+# Labels of TypeConstraints on a child that are defined in the namespace,
+# as ElementIndex.get_type_refs finds them
+def type_refs(child: dict, namespace: str) -> list:
+  refs = []
+  for c in child.get('constraints', []):
+    if c.get('type', '') == 'TypeConstraint':
+      name = c.get('isA', {}).get('_name', '')
+      if name and c.get('isA', {}).get('_namespace', '') == namespace:
+        refs.append(name)
+  return refs
+
+
+# Namespace label to Namespace. Namespaces added as json with add are built
+# on first access with the registry in use when the mapping was made, and
+# dropped if they don't parse.
+class LazyNamespaces(MutableMapping):
+
+  def __init__(self):
+    self.entries = dict()
+    self.registry = get_registry()
+
+  def add(self, namespace: dict) -> None:
+    self.entries[namespace.get('label', '')] = namespace
+
+  def __getitem__(self, label: str) -> Namespace:
+    entry = self.entries[label]
+    if not isinstance(entry, dict):
+      return entry
+    with use_registry(self.registry):
+      n = parse_namespace(entry)
+    if n is None:
+      del self.entries[label]
+      raise KeyError(label)
+    self.entries[label] = n
+    return n
+
+  def __setitem__(self, label: str, namespace) -> None:
+    self.entries[label] = namespace
+
+  def __delitem__(self, label: str) -> None:
+    del self.entries[label]
+
+  def __contains__(self, label) -> bool:
+    return label in self.entries
+
+  def __iter__(self):
+    return iter(list(self.entries))
+
+  def __len__(self) -> int:
+    return len(self.entries)
+
+  # Builds as it goes, leaving out namespaces that don't parse
+  def items(self):
+    for label in self:
+      n = self.get(label)
+      if n is not None:
+        yield label, n
+
+  def values(self):
+    for _, n in self.items():
+      yield n
 
 
 class Namespaces:
 
-  def __init__(self, namespaces):
+  def __init__(self, namespaces, select: Selection=None):
     self.label = namespaces.get('label', '')
     self.type = namespaces.get('type', '')
-    self.namespaces = dict()
+    self.select = select
+    self.namespaces = LazyNamespaces()
     self.parse_namespaces(namespaces.get('children', []))
 
+  # Builds every namespace, or with a selection looks up the codesystems of
+  # every namespace in document order, so abbreviations match converting
+  # everything, and keeps the selected ones to build on first access
   def parse_namespaces(self, namespaces: list) -> list:
     for name in namespaces:
-      try:
-        n = Namespace(name)
-      except Exception as e:
-        print('PARSE_ERROR', name['label'], e)
+      if self.select is None:
+        n = parse_namespace(name)
+        if n is not None:
+          self.namespaces[n.label] = n
         continue
-      self.namespaces[n.label] = n
\ No newline at end of file
+      look_up_namespace(name)
+      if is_selected(name.get('label', ''), self.select):
+        self.namespaces.add(name)
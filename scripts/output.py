@@ -0,0 +1,141 @@
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+from contextlib import contextmanager
+
+
+# Creates a new temporary file next to path, with the mode open gives new
+# files, and returns its descriptor and name
+def create_temporary(path: str) -> tuple:
+  while True:
+    tmp = '{0}.{1}.tmp'.format(path, os.urandom(4).hex())
+    try:
+      return os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666), tmp
+    except FileExistsError:
+      continue
+
+
+# Writes json to a temporary file and moves it over path, so readers and
+# interrupted runs never see a partial file
+def write_json_atomic(path: str, data) -> None:
+  fd, tmp = create_temporary(path)
+  try:
+    with os.fdopen(fd, 'w') as tmp_file:
+      json.dump(data, tmp_file, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+  except BaseException:
+    os.remove(tmp)
+    raise
+
+
+# Output file name for a namespace
+def namespace_filename(label: str) -> str:
+  return '{0}.txt'.format(label.replace('.', '_'))
+
+
+# Output file name for the valuesets of a namespace
+def value_set_filename(namespace: str) -> str:
+  return '{0}_vs.txt'.format(namespace.replace('.', '_'))
+
+
+# Writes output files into a directory. Files are streamed through a large
+# buffer, or with a batch size, held in memory and written out together
+# once the batch fills so each file costs a single write call.
+class FileOutput:
+
+  def __init__(self, directory: str, buffer_size: int=1 << 20,
+               batch_size: int=0):
+    self.directory = directory
+    self.buffer_size = buffer_size
+    self.batch_size = batch_size
+    self.pending = []
+    self.pending_size = 0
+    os.makedirs(directory, exist_ok=True)
+
+  def path(self, name: str) -> str:
+    return os.path.join(self.directory, name)
+
+  # Returns a text stream for one output file
+  @contextmanager
+  def open(self, name: str):
+    if not self.batch_size:
+      with open(self.path(name), 'w', buffering=self.buffer_size) as outfile:
+        yield outfile
+      return
+    stream = io.StringIO()
+    yield stream
+    text = stream.getvalue()
+    self.pending.append((name, text))
+    self.pending_size += len(text)
+    if self.pending_size >= self.batch_size:
+      self.flush()
+
+  # Writes every pending file of the batch
+  def flush(self) -> None:
+    for name, text in self.pending:
+      with open(self.path(name), 'w', buffering=self.buffer_size) as outfile:
+        outfile.write(text)
+    self.pending = []
+    self.pending_size = 0
+
+  def close(self) -> None:
+    self.flush()
+
+
+# Writes every output file into a single .zip, .tar, .tar.gz or .tgz archive
+class ArchiveOutput:
+
+  def __init__(self, path: str):
+    self.path = path
+    directory = os.path.dirname(path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    if path.endswith('.zip'):
+      self.archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    elif path.endswith('.tar.gz') or path.endswith('.tgz'):
+      self.archive = tarfile.open(path, 'w:gz')
+    elif path.endswith('.tar'):
+      self.archive = tarfile.open(path, 'w')
+    else:
+      raise Exception('archive must end in .zip, .tar, .tar.gz or .tgz')
+
+  @contextmanager
+  def open(self, name: str):
+    stream = io.StringIO()
+    yield stream
+    data = stream.getvalue().encode('utf-8')
+    if isinstance(self.archive, zipfile.ZipFile):
+      self.archive.writestr(name, data)
+    else:
+      info = tarfile.TarInfo(name)
+      info.size = len(data)
+      info.mtime = time.time()
+      self.archive.addfile(info, io.BytesIO(data))
+
+  def flush(self) -> None:
+    pass
+
+  def close(self) -> None:
+    self.archive.close()
+
+
+# Keeps every output file in memory as a dict of file name to text
+class MemoryOutput:
+
+  def __init__(self):
+    self.files = dict()
+
+  @contextmanager
+  def open(self, name: str):
+    stream = io.StringIO()
+    yield stream
+    self.files[name] = stream.getvalue()
+
+  def flush(self) -> None:
+    pass
+
+  def close(self) -> None:
+    pass
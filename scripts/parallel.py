@@ -0,0 +1,104 @@
+import multiprocessing
+
+from scripts.codesystems import CodeSystems
+from scripts.namespace import Namespace
+from scripts.value_sets import ValueSet, ValueSets
+
+# Spec children handed to each worker process by init_worker
+worker_data = dict()
+
+
+# Forked workers share the parent's string hashing, so set ordering in the
+# rendered text (Uses, CodeSystem headers) matches a serial run
+def get_context():
+  if 'fork' in multiprocessing.get_all_start_methods():
+    return multiprocessing.get_context('fork')
+  return multiprocessing.get_context()
+
+
+def init_worker(namespaces: list, value_sets: list) -> None:
+  worker_data['Namespaces'] = namespaces
+  worker_data['ValueSets'] = value_sets
+
+
+# Builds one namespace or value set and returns the codesystems it looked up
+def record_lookups(task: tuple) -> list:
+  kind, index = task
+  CodeSystems.start_recording()
+  try:
+    if kind == 'Namespaces':
+      Namespace(worker_data[kind][index])
+    else:
+      ValueSet(worker_data[kind][index])
+  except Exception:
+    pass
+  return CodeSystems.stop_recording()
+
+
+# Renders a group of namespaces with the final abbreviation state, returning
+# each label with its text and the namespaces it uses
+def render_namespaces(task: tuple) -> list:
+  state, indexes = task
+  CodeSystems.set_state(state)
+  rendered = []
+  for i in indexes:
+    name = worker_data['Namespaces'][i]
+    try:
+      n = Namespace(name)
+    except Exception as e:
+      print('PARSE_ERROR', name['label'], e)
+      continue
+    rendered.append((n.label, str(n), sorted(n.uses)))
+  return rendered
+
+
+# Renders every value set sharing a namespace with the final state
+def render_value_sets(task: tuple) -> list:
+  state, indexes = task
+  CodeSystems.set_state(state)
+  children = [worker_data['ValueSets'][i] for i in indexes]
+  value_sets = ValueSets({'children': children}).value_sets
+  return [(i, str(value_sets[i])) for i in value_sets]
+
+
+# Splits a list into roughly equal contiguous chunks
+def chunk(items: list, count: int) -> list:
+  size = max(1, -(-len(items) // count))
+  return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+# Converts namespaces and value sets over a process pool and returns two
+# dicts of label to rendered text, identical to str() of a serial run, and
+# the namespaces each namespace uses
+def convert(namespaces: dict, value_sets: dict, jobs: int) -> tuple:
+  ns_children = namespaces.get('children', [])
+  vs_children = value_sets.get('children', [])
+  tasks = [('Namespaces', i) for i in range(len(ns_children))]
+  tasks += [('ValueSets', i) for i in range(len(vs_children))]
+
+  # Value sets sharing a namespace are rendered together, in document order
+  vs_groups = dict()
+  for i, child in enumerate(vs_children):
+    vs_groups.setdefault(child.get('namespace', ''), []).append(i)
+
+  init_args = (ns_children, vs_children)
+  with get_context().Pool(jobs, init_worker, init_args) as pool:
+    # New abbreviations must be minted in serial lookup order
+    for lookups in pool.map(record_lookups, tasks, chunksize=8):
+      CodeSystems.replay(lookups)
+    state = CodeSystems.get_state()
+
+    ns_tasks = [(state, i) for i in chunk(list(range(len(ns_children))), jobs)]
+    vs_tasks = [(state, vs_groups[i]) for i in vs_groups]
+    ns_result = pool.map_async(render_namespaces, ns_tasks)
+    vs_result = pool.map_async(render_value_sets, vs_tasks)
+    rendered_ns = dict()
+    uses = dict()
+    for rendered in ns_result.get():
+      for label, text, namespace_uses in rendered:
+        rendered_ns[label] = text
+        uses[label] = namespace_uses
+    rendered_vs = dict()
+    for rendered in vs_result.get():
+      rendered_vs.update(rendered)
+  return rendered_ns, rendered_vs, uses
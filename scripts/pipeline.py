@@ -0,0 +1,108 @@
+import queue
+import threading
+
+from scripts import profiling
+from scripts.codesystems import use_registry
+from scripts.namespace import look_up_namespace, parse_namespace
+from scripts.output import namespace_filename, value_set_filename
+from scripts.selection import Selection, is_selected
+from scripts.value_sets import ValueSet, ValueSets, look_up_value_set
+
+# Put on a queue after the last item
+DONE = None
+# Items each queue holds before the stage feeding it waits
+DEPTH = 8
+
+
+# Parses, renders and writes as three stages joined by bounded queues, so
+# file writes overlap with parsing and rendering, and only about depth
+# namespaces are held at once. Value sets sharing a namespace go to one
+# file, so those are rendered once every spec child is parsed.
+class Pipeline:
+
+  def __init__(self, backend, codesystems, depth: int=DEPTH,
+               select: Selection=None):
+    self.backend = backend
+    self.codesystems = codesystems
+    # Namespaces to convert, the others only have codesystems looked up
+    self.select = select
+    self.models = queue.Queue(depth)
+    self.rendered = queue.Queue(depth)
+    self.errors = []
+    # Namespaces each parsed namespace uses, for the dependency graph
+    self.uses = dict()
+
+  # Parses (section type, child) pairs on this thread while worker threads
+  # render and write, then raises the first error of any stage
+  def run(self, children) -> None:
+    threads = [
+        threading.Thread(target=self.stage,
+                         args=(self.render, self.models, self.rendered)),
+        threading.Thread(target=self.stage,
+                         args=(self.write, self.rendered, None))
+    ]
+    for thread in threads:
+      thread.start()
+    try:
+      with use_registry(self.codesystems):
+        self.parse(children)
+    finally:
+      self.models.put(DONE)
+      for thread in threads:
+        thread.join()
+    if self.errors:
+      raise self.errors[0]
+
+  # Only this stage looks up codesystems, so abbreviations are minted in
+  # document order as in a serial run
+  def parse(self, children) -> None:
+    value_sets = ValueSets({})
+    for section_type, child in children:
+      if self.errors:
+        return
+      if section_type == 'Namespaces':
+        if not is_selected(child.get('label', ''), self.select):
+          look_up_namespace(child)
+          continue
+        with profiling.timer('stage', 'parse'):
+          n = parse_namespace(child)
+        if n is not None:
+          self.uses[n.label] = n.uses
+          self.models.put((namespace_filename(n.label), n))
+      elif section_type == 'ValueSets':
+        if not is_selected(child.get('namespace', ''), self.select):
+          look_up_value_set(child)
+          continue
+        with profiling.timer('stage', 'parse'):
+          value_sets.add(ValueSet(child))
+    for namespace, models in value_sets.value_sets.items():
+      self.models.put((value_set_filename(namespace), models))
+
+  # Runs work on each item of inbox and passes results on to outbox. After a
+  # failure items are drained without work so earlier stages never block.
+  def stage(self, work, inbox: queue.Queue, outbox: queue.Queue) -> None:
+    with use_registry(self.codesystems):
+      while True:
+        item = inbox.get()
+        if item is DONE:
+          break
+        if self.errors:
+          continue
+        try:
+          result = work(*item)
+        except Exception as e:
+          self.errors.append(e)
+          continue
+        if outbox is not None:
+          outbox.put(result)
+    if outbox is not None:
+      outbox.put(DONE)
+
+  def render(self, filename: str, model) -> tuple:
+    with profiling.timer('render', filename):
+      return filename, str(model)
+
+  def write(self, filename: str, text: str) -> None:
+    with profiling.timer('write', filename):
+      with self.backend.open(filename) as outfile:
+        outfile.write(text)
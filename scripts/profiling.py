@@ -0,0 +1,80 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Instrumentation collecting timers and counters, None while disabled
+active = None
+
+
+# Timers and counters grouped by category, each keyed by e.g. a namespace
+# label or constraint type. Timers are inclusive of nested timers.
+class Instrumentation:
+
+  def __init__(self):
+    self.timers = defaultdict(lambda: defaultdict(lambda: [0, 0.0]))
+    self.counters = defaultdict(lambda: defaultdict(int))
+    self.info = dict()
+
+  def add_time(self, category: str, key: str, seconds: float) -> None:
+    timer = self.timers[category][key]
+    timer[0] += 1
+    timer[1] += seconds
+
+  def count(self, category: str, key: str, amount: int=1) -> None:
+    self.counters[category][key] += amount
+
+  # Returns the timers, slowest first, and counters as json data
+  def report(self) -> dict:
+    from scripts.constraints import value_set_cache_stats
+    timers = dict()
+    for category in self.timers:
+      entries = self.timers[category]
+      keys = sorted(entries, key=lambda k: entries[k][1], reverse=True)
+      timers[category] = {k: {
+          'count': entries[k][0],
+          'seconds': round(entries[k][1], 6)
+      } for k in keys}
+    counters = {i: dict(self.counters[i]) for i in self.counters}
+    return {
+        'info': self.info,
+        'timers': timers,
+        'counters': counters,
+        'value_set_cache': value_set_cache_stats()
+    }
+
+
+def enable() -> Instrumentation:
+  global active
+  active = Instrumentation()
+  return active
+
+
+def disable() -> None:
+  global active
+  active = None
+
+
+# Times the enclosed block when instrumentation is enabled
+@contextmanager
+def timer(category: str, key: str=''):
+  if active is None:
+    yield
+    return
+  instrumentation = active
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    instrumentation.add_time(category, key, time.perf_counter() - start)
+
+
+# Counts an event when instrumentation is enabled
+def count(category: str, key: str='', amount: int=1) -> None:
+  if active is not None:
+    active.count(category, key, amount)
+
+
+# Records a fact about the run, e.g. which json decoder was used
+def set_info(name: str, value) -> None:
+  if active is not None:
+    active.info[name] = value
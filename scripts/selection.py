@@ -0,0 +1,27 @@
+from fnmatch import fnmatchcase
+
+
+# Namespace names or glob patterns picking which namespaces and value set
+# namespaces to convert, remembering which patterns matched anything
+class Selection:
+
+  def __init__(self, patterns: list):
+    self.patterns = list(patterns)
+    self.matched = set()
+
+  def __contains__(self, name: str) -> bool:
+    found = False
+    for pattern in self.patterns:
+      if fnmatchcase(name, pattern):
+        self.matched.add(pattern)
+        found = True
+    return found
+
+  # Patterns that haven't matched a namespace so far
+  def unmatched(self) -> list:
+    return [i for i in self.patterns if i not in self.matched]
+
+
+# Whether a namespace is converted, every one is without a selection
+def is_selected(name: str, select: Selection) -> bool:
+  return select is None or name in select
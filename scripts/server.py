@@ -0,0 +1,279 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scripts.codesystems import CodeSystemRegistry, CodeSystems
+from scripts.codesystems import spec_codesystems, use_registry
+from scripts.incremental import build_recorded, codesystem_hash, content_hash
+from scripts.namespace import Namespace
+from scripts.output import namespace_filename, value_set_filename
+from scripts.value_sets import ValueSet, ValueSets
+
+
+# Dict that evicts its least recently used entries past a maximum size
+class BoundedCache(OrderedDict):
+
+  def __init__(self, max_size: int):
+    super().__init__()
+    self.max_size = max_size
+    self.lock = threading.Lock()
+
+  def get(self, key, default=None):
+    with self.lock:
+      if key not in self:
+        return default
+      self.move_to_end(key)
+      return super().__getitem__(key)
+
+  def __setitem__(self, key, value):
+    with self.lock:
+      super().__setitem__(key, value)
+      self.move_to_end(key)
+      while len(self) > self.max_size:
+        self.popitem(last=False)
+
+
+# Converts specs while keeping the codesystem table, the codesystems every
+# subtree looks up and previously rendered text warm between requests
+class ConversionService:
+
+  def __init__(self, max_specs: int=16, max_rendered: int=4096,
+               codesystems_path: str=None):
+    # Every conversion starts from the configured abbreviations
+    self.base_state = CodeSystemRegistry(codesystems_path).get_state()
+    self.specs = BoundedCache(max_specs)
+    self.lookups = BoundedCache(max_rendered * 4)
+    self.rendered = BoundedCache(max_rendered)
+
+  # Converts a full spec, or a diff of namespaces and value sets against a
+  # spec converted earlier, and returns its id and output files
+  def convert(self, request: dict) -> dict:
+    if 'base' in request:
+      n, v, codesystems = self.apply_diff(request)
+    else:
+      sections = {i.get('type'): i for i in request.get('children', [])}
+      if 'Namespaces' not in sections or 'ValueSets' not in sections:
+        raise Exception('Missing Namespaces or ValueSets')
+      n, v = sections['Namespaces'], sections['ValueSets']
+      codesystems = spec_codesystems(sections.get('CodeSystems', {}))
+    spec_id = content_hash([n, v, codesystems])
+    self.specs[spec_id] = (n, v, codesystems)
+    # Requests run concurrently, each with its own abbreviations
+    with use_registry(CodeSystemRegistry.from_state(self.base_state)):
+      CodeSystems.seed(codesystems)
+      files, rendered = self.render(n.get('children', []),
+                                    v.get('children', []))
+    return {'spec_id': spec_id, 'files': files, 'rendered': rendered}
+
+  # Replaces namespaces by label and value sets by namespace and label
+  def apply_diff(self, request: dict) -> tuple:
+    base = self.specs.get(request['base'])
+    if base is None:
+      raise Exception('Unknown base spec {0}'.format(request['base']))
+    n, v, codesystems = base
+    ns_children = {i.get('label'): i for i in n.get('children', [])}
+    for child in request.get('namespaces', []):
+      ns_children[child.get('label')] = child
+    vs_children = OrderedDict()
+    for child in v.get('children', []):
+      vs_children[(child.get('namespace'), child.get('label'))] = child
+    for child in request.get('value_sets', []):
+      vs_children[(child.get('namespace'), child.get('label'))] = child
+    n = dict(n, children=list(ns_children.values()))
+    v = dict(v, children=list(vs_children.values()))
+    return n, v, codesystems
+
+  # Parses only subtrees without recorded lookups, then renders only
+  # subtrees whose text isn't cached for the final abbreviations
+  def render(self, ns_children: list, vs_children: list) -> tuple:
+    models = dict()
+    namespaces = []
+    for child in ns_children:
+      digest = content_hash(child)
+      lookups = self.lookups.get(digest)
+      if lookups is None:
+        models[digest], lookups = build_recorded(Namespace, child)
+        self.lookups[digest] = lookups
+      else:
+        CodeSystems.replay(lookups)
+      namespaces.append((child, digest, lookups))
+
+    groups = OrderedDict()
+    for child in vs_children:
+      digest = content_hash(child)
+      lookups = self.lookups.get(digest)
+      if lookups is None:
+        models[digest], lookups = build_recorded(ValueSet, child)
+        self.lookups[digest] = lookups
+      else:
+        CodeSystems.replay(lookups)
+      group = groups.setdefault(child.get('namespace', ''), [])
+      group.append((child, digest, lookups))
+
+    files = dict()
+    rendered = 0
+    for child, digest, lookups in namespaces:
+      key = (digest, codesystem_hash(lookups))
+      text = self.rendered.get(key)
+      if text is None:
+        if digest in models:
+          model = models[digest]
+        else:
+          model = build_recorded(Namespace, child)[0]
+        if model is None:
+          continue
+        text = str(model)
+        self.rendered[key] = text
+        rendered += 1
+      files[namespace_filename(child.get('label', ''))] = text
+
+    for namespace, group in groups.items():
+      digests = [i[1] for i in group]
+      lookups = [c for i in group for c in i[2]]
+      key = (content_hash(digests), codesystem_hash(lookups))
+      text = self.rendered.get(key)
+      if text is None:
+        value_sets = ValueSets({})
+        for child, digest, _ in group:
+          value_sets.add(models[digest] if digest in models else
+                         ValueSet(child))
+        text = str(value_sets.value_sets[namespace])
+        self.rendered[key] = text
+        rendered += 1
+      files[value_set_filename(namespace)] = text
+    return files, rendered
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+
+  # Unix socket clients have no address
+  def address_string(self) -> str:
+    return str(self.client_address[0]) if self.client_address else 'unix'
+
+  def send_json(self, status: int, data: dict) -> None:
+    body = json.dumps(data).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self) -> None:
+    if self.path == '/health':
+      self.send_json(200, {'status': 'ok'})
+    else:
+      self.send_json(404, {'error': 'Not found'})
+
+  def do_POST(self) -> None:
+    if self.path != '/convert':
+      self.send_json(404, {'error': 'Not found'})
+      return
+    try:
+      length = int(self.headers.get('Content-Length', 0))
+      request = json.loads(self.rfile.read(length).decode('utf-8'))
+      result = self.server.service.convert(request)
+    except Exception as e:
+      self.send_json(400, {'error': str(e)})
+      return
+    self.send_json(200, result)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                              socketserver.UnixStreamServer):
+  daemon_threads = True
+
+
+# Returns a server handling each request on its own thread, listening on
+# a unix socket when socket_path is given and on host and port otherwise
+def make_server(host: str='127.0.0.1', port: int=8765,
+                socket_path: str=None, service: ConversionService=None):
+  if socket_path:
+    if os.path.exists(socket_path):
+      os.remove(socket_path)
+    server = ThreadingUnixHTTPServer(socket_path, ConversionHandler)
+  else:
+    server = ThreadingHTTPServer((host, port), ConversionHandler)
+  server.service = service if service is not None else ConversionService()
+  return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+  def __init__(self, socket_path: str):
+    super().__init__('localhost')
+    self.socket_path = socket_path
+
+  def connect(self) -> None:
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.connect(self.socket_path)
+
+
+# Client for a running conversion server
+class ConversionClient:
+
+  def __init__(self, host: str='127.0.0.1', port: int=8765,
+               socket_path: str=None):
+    self.host = host
+    self.port = port
+    self.socket_path = socket_path
+
+  def request(self, method: str, path: str, data: dict=None) -> dict:
+    if self.socket_path:
+      connection = UnixHTTPConnection(self.socket_path)
+    else:
+      connection = http.client.HTTPConnection(self.host, self.port)
+    try:
+      body = json.dumps(data).encode('utf-8') if data is not None else None
+      headers = {'Content-Type': 'application/json'} if body else {}
+      connection.request(method, path, body, headers)
+      response = connection.getresponse()
+      result = json.loads(response.read().decode('utf-8'))
+    finally:
+      connection.close()
+    if response.status != 200:
+      raise Exception(result.get('error', response.reason))
+    return result
+
+  # Converts a full spec
+  def convert(self, spec: dict) -> dict:
+    return self.request('POST', '/convert', spec)
+
+  # Converts a spec converted earlier with some namespaces or value sets
+  # replaced, identified by the spec_id of the earlier conversion
+  def convert_diff(self, base: str, namespaces: list=(),
+                   value_sets: list=()) -> dict:
+    data = {
+        'base': base,
+        'namespaces': list(namespaces),
+        'value_sets': list(value_sets)
+    }
+    return self.request('POST', '/convert', data)
+
+
+def main(args):
+  parser = argparse.ArgumentParser(description='JSON to Cameo server')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8765)
+  parser.add_argument('--socket', help='listen on this unix socket instead')
+  parser.add_argument('--codesystems',
+                      help='codesystem abbreviations config json file')
+  options = parser.parse_args(args)
+  service = ConversionService(codesystems_path=options.codesystems)
+  server = make_server(options.host, options.port, options.socket, service)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
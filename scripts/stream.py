@@ -0,0 +1,198 @@
+import json
+
+DECODER = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+
+
+# Incremental reader that decodes one JSON value at a time from a text stream
+class JsonReader:
+
+  def __init__(self, stream, chunk_size: int=1 << 16):
+    self.stream = stream
+    self.chunk_size = chunk_size
+    self.buffer = ''
+    self.pos = 0
+    self.eof = False
+
+  # Reads more input, dropping everything already consumed from the buffer
+  def fill(self, size: int=0) -> bool:
+    if self.eof:
+      return False
+    chunk = self.stream.read(max(size, self.chunk_size))
+    if not chunk:
+      self.eof = True
+      return False
+    self.buffer = self.buffer[self.pos:] + chunk
+    self.pos = 0
+    return True
+
+  # Returns the next non-whitespace character without consuming it
+  def peek(self) -> str:
+    while True:
+      buffer = self.buffer
+      while self.pos < len(buffer) and buffer[self.pos] in WHITESPACE:
+        self.pos += 1
+      if self.pos < len(buffer):
+        return buffer[self.pos]
+      if not self.fill():
+        raise Exception('Unexpected end of JSON input')
+
+  def expect(self, char: str) -> None:
+    if self.peek() != char:
+      text = 'Expected {0!r} at {1!r}'
+      raise Exception(text.format(char, self.buffer[self.pos:self.pos + 20]))
+    self.pos += 1
+
+  # Decodes one complete value, growing the buffer until the value fits
+  def value(self):
+    return self.decode()[0]
+
+  # Decodes one complete value and returns it with its json text
+  def raw_value(self) -> tuple:
+    value, start, end = self.decode()
+    return value, self.buffer[start:end]
+
+  # Decodes the next value, returns it with its start and end in the buffer
+  def decode(self) -> tuple:
+    self.peek()
+    while True:
+      try:
+        value, end = DECODER.raw_decode(self.buffer, self.pos)
+      except json.JSONDecodeError:
+        if not self.fill(len(self.buffer) - self.pos):
+          raise
+        continue
+      # A number ending the buffer may continue in the next chunk
+      if end == len(self.buffer) and self.fill():
+        continue
+      start = self.pos
+      self.pos = end
+      return value, start, end
+
+  # Yields each key of an object whose opening brace has been consumed,
+  # the caller must consume the member value before resuming iteration
+  def members(self):
+    if self.peek() == '}':
+      self.pos += 1
+      return
+    while True:
+      key = self.value()
+      self.expect(':')
+      yield key
+      char = self.peek()
+      self.pos += 1
+      if char == '}':
+        return
+      elif char != ',':
+        raise Exception('Malformed JSON object near {0!r}'.format(char))
+
+  # Yields once per element of an array whose opening bracket was consumed
+  def elements(self):
+    if self.peek() == ']':
+      self.pos += 1
+      return
+    while True:
+      yield
+      char = self.peek()
+      self.pos += 1
+      if char == ']':
+        return
+      elif char != ',':
+        raise Exception('Malformed JSON array near {0!r}'.format(char))
+
+
+# Streams the sections of a spec one namespace or value set at a time. With
+# raw, each child is followed by its json text.
+class SpecStream:
+
+  def __init__(self, filename: str, chunk_size: int=1 << 16,
+               raw: bool=False):
+    self.filename = filename
+    self.chunk_size = chunk_size
+    self.raw = raw
+    # Scalar members of every top level section, filled in while iterating
+    self.sections = []
+
+  # Yields (section type, child) for every child of every top level section
+  def __iter__(self):
+    with open(self.filename, 'r') as json_file:
+      reader = JsonReader(json_file, self.chunk_size)
+      reader.expect('{')
+      for key in reader.members():
+        if key != 'children':
+          reader.value()
+          continue
+        reader.expect('[')
+        for _ in reader.elements():
+          yield from self.parse_section(reader)
+
+  # Urls of the spec's CodeSystems section, so streaming can seed their
+  # abbreviations before the first namespace. Other sections are decoded a
+  # child at a time and dropped, which is quicker than walking their text.
+  def codesystems(self) -> list:
+    urls = []
+    with open(self.filename, 'r') as json_file:
+      reader = JsonReader(json_file, self.chunk_size)
+      reader.expect('{')
+      for key in reader.members():
+        if key != 'children':
+          reader.value()
+          continue
+        reader.expect('[')
+        for _ in reader.elements():
+          section_type, section_urls = self.scan_section(reader)
+          if section_type == 'CodeSystems':
+            urls.extend(section_urls)
+    return urls
+
+  # Returns the type of a section and the url of each of its children,
+  # keeping none unless the type is CodeSystems or not read yet
+  def scan_section(self, reader: JsonReader) -> tuple:
+    section_type = None
+    urls = []
+    reader.expect('{')
+    for key in reader.members():
+      if key != 'children':
+        value = reader.value()
+        if key == 'type':
+          section_type = value
+        continue
+      reader.expect('[')
+      for _ in reader.elements():
+        if section_type in (None, 'CodeSystems') and reader.peek() == '{':
+          urls.append(self.scan_url(reader))
+        else:
+          reader.value()
+    return section_type, [i for i in urls if i]
+
+  # Decodes the url of a child, and each other member on its own
+  def scan_url(self, reader: JsonReader):
+    url = None
+    reader.expect('{')
+    for key in reader.members():
+      value = reader.value()
+      if key == 'url':
+        url = value
+    return url
+
+  # Yields the children of one section, buffering them only if the section
+  # type appears after its children in the document
+  def parse_section(self, reader: JsonReader):
+    section = dict()
+    pending = []
+    reader.expect('{')
+    for key in reader.members():
+      if key != 'children':
+        section[key] = reader.value()
+        continue
+      reader.expect('[')
+      for _ in reader.elements():
+        child, text = reader.raw_value()
+        item = (child, text) if self.raw else (child,)
+        if 'type' in section:
+          yield (section['type'],) + item
+        else:
+          pending.append(item)
+    self.sections.append(section)
+    for item in pending:
+      yield (section.get('type'),) + item
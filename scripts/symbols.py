@@ -0,0 +1,25 @@
+import sys
+
+# Whether model strings are interned, see disable
+enabled = True
+
+
+# Returns the one shared copy of a string that repeats across models, like a
+# namespace name, element label, codesystem url or cardinality, so it's
+# stored once rather than once per occurrence in the spec. Anything but a
+# str is returned as is.
+def intern(text):
+  if enabled and type(text) is str:
+    return sys.intern(text)
+  return text
+
+
+def enable() -> None:
+  global enabled
+  enabled = True
+
+
+# Keeps a separate copy of every string, e.g. to measure what interning saves
+def disable() -> None:
+  global enabled
+  enabled = False
@@ -1,4 +1,8 @@
+import io
+
+from scripts import profiling, symbols
 from scripts.codesystems import CodeSystems
+from scripts.selection import Selection, is_selected
 
 
 # Formats version based on major, minor, and patch values
@@ -7,11 +11,12 @@ def get_version(version_dict):
   minor = version_dict.get('minor', 0)
   patch = version_dict.get('patch', 0)
   # return '{}.{}.{}'.format(major, minor, patch)
-  return '{}.{}'.format(major, minor)
+  return symbols.intern('{}.{}'.format(major, minor))
 
 
 # Manages a single value within a value set
 class Value:
+  __slots__ = ('label', 'system', 'abbrev', 'code', 'display_text')
 
   def __init__(self, value: dict):
     self.label = ''
@@ -25,7 +30,7 @@ class Value:
   def parse_code_dict(self, code_dict: dict) -> None:
     self.label = code_dict.get('label', '')
     self.code = code_dict.get('code', '')
-    self.system = code_dict.get('system', '')
+    self.system = symbols.intern(code_dict.get('system', ''))
     self.abbrev = CodeSystems.get(self.system)
 
   # Handles code type ValueSetIncludesFromCodeRule
@@ -51,19 +56,40 @@ class Value:
   # Handles code type ValueSetIncludesFromCodeSystemRule
   def handle_from_code_system_rule(self, value: dict) -> None:
     self.label = value.get('label', '')
-    self.system = value.get('system', '')
+    self.system = symbols.intern(value.get('system', ''))
     self.abbrev = CodeSystems.get(self.system)
     self.display_text = "Includes codes from {0}".format(self.abbrev)
 
+  # Handler for each rule type, called with the Value and the rule
+  type_handler = {
+      'ValueSetIncludesFromCodeRule': handle_from_code_rule,
+      'ValueSetIncludesCodeRule': handle_code_rule,
+      'ValueSetIncludesDescendentsRule': handle_descendents_rule,
+      'ValueSetIncludesFromCodeSystemRule': handle_from_code_system_rule
+  }
+
+  # Whether each handler above looks up the system of the rule's code or of
+  # the rule itself, a type registered later is built for its lookup instead
+  system_in_code = {
+      'ValueSetIncludesFromCodeRule': True,
+      'ValueSetIncludesCodeRule': True,
+      'ValueSetIncludesDescendentsRule': True,
+      'ValueSetIncludesFromCodeSystemRule': False
+  }
+
+  # Registers a handler for a value set rule type, replacing any existing
+  # one. Can be used as a decorator when handler is omitted.
+  @classmethod
+  def register(cls, v_type: str, handler=None):
+    if handler is None:
+      return lambda h: cls.register(v_type, h)
+    cls.type_handler[v_type] = handler
+    cls.system_in_code.pop(v_type, None)
+    return handler
+
   # Identifies and runs the handler based on the type
   def run_handler(self, value: dict) -> None:
-    type_handler = {
-        'ValueSetIncludesFromCodeRule': self.handle_from_code_rule,
-        'ValueSetIncludesCodeRule': self.handle_code_rule,
-        'ValueSetIncludesDescendentsRule': self.handle_descendents_rule,
-        'ValueSetIncludesFromCodeSystemRule': self.handle_from_code_system_rule
-    }
-    type_handler[value['type']](value)
+    self.type_handler[value['type']](self, value)
 
   # Sets string representation to be display text
   def __str__(self):
@@ -74,13 +100,14 @@ class Value:
 class ValueSet:
 
   def __init__(self, value_set: dict):
-    self.label = value_set.get('label', '')
-    self.namespace = value_set.get('namespace', '')
-    self.version = get_version(value_set.get('grammarVersion', {}))
-    self.description = value_set.get('description', '')
-    self.codesystems = dict()
-    self.concepts = self.build_concepts(value_set.get('concepts', []))
-    self.children = self.build_children(value_set.get('children', []))
+    with profiling.timer('value_set', value_set.get('namespace', '')):
+      self.label = value_set.get('label', '')
+      self.namespace = symbols.intern(value_set.get('namespace', ''))
+      self.version = get_version(value_set.get('grammarVersion', {}))
+      self.description = value_set.get('description', '')
+      self.codesystems = dict()
+      self.concepts = self.build_concepts(value_set.get('concepts', []))
+      self.children = self.build_children(value_set.get('children', []))
 
   # Makes each child into a Value structure and aggregates codesystems
   def build_children(self, children: list) -> list:
@@ -89,7 +116,8 @@ class ValueSet:
       value = Value(child)
       value_children.append(value)
       if len(value.system) and len(value.abbrev):
-        self.codesystems[value.system] = value.abbrev
+        system = CodeSystems.canonical(value.system)
+        self.codesystems[system] = value.abbrev
     return value_children
 
   # Build a list of codesystems used in the child values
@@ -110,7 +138,7 @@ class ValueSet:
       system = concept.get('system', '')
       abbrev = CodeSystems.get(system)
       if len(system) and len(abbrev):
-        self.codesystems[system] = abbrev
+        self.codesystems[CodeSystems.canonical(system)] = abbrev
       cs.append('{0:{3}}{1}#{2}'.format('Concept:', abbrev, code, 40))
     return cs
 
@@ -121,14 +149,27 @@ class ValueSet:
     else:
       return '{0:{2}}"{1}"'.format('Description:', self.description, 40)
 
+  # Writes the value set to a stream one line at a time
+  def write_to(self, stream) -> None:
+    stream.write('{0:{2}}{1}'.format('ValueSet:', self.label, 40))
+    for concept in self.concepts:
+      stream.write('\n')
+      stream.write(concept)
+    description = self.build_description()
+    if description:
+      stream.write('\n')
+      stream.write(description)
+    # A single value without display text adds no line
+    if len(self.children) > 1 or self.children and str(self.children[0]):
+      for child in self.children:
+        stream.write('\n')
+        stream.write(str(child))
+
   # Return the string representation of a value set
   def __str__(self):
-    header = '{0:{2}}{1}'.format('ValueSet:', self.label, 40)
-    concepts = '\n'.join(self.concepts)
-    description = self.build_description()
-    values = '\n'.join(str(c) for c in self.children)
-    output = [header, concepts, description, values]
-    return '\n'.join(filter(None, output))
+    output = io.StringIO()
+    self.write_to(output)
+    return output.getvalue()
 
 
 # Manages all valuesets for a given namespace
@@ -137,12 +178,12 @@ class ValueSetNamespace:
   def __init__(self, vs: ValueSet):
     self.namespace = vs.namespace
     self.version = vs.version
-    self.value_sets = [str(vs)]
+    self.value_sets = [vs]
     self.code_system_set = set(vs.build_codesystems())
 
   # Add a valueset with the same namespace
   def add(self, vs: ValueSet) -> None:
-    self.value_sets.append(str(vs))
+    self.value_sets.append(vs)
     self.code_system_set.update(vs.build_codesystems())
 
   # Build the header
@@ -155,27 +196,60 @@ class ValueSetNamespace:
   def build_codesystems(self) -> str:
     return '\n'.join(self.code_system_set)
 
+  # Writes the valuesets within a namespace to a stream
+  def write_to(self, stream) -> None:
+    stream.write(self.build_header())
+    code_systems = self.build_codesystems()
+    if code_systems:
+      stream.write('\n\n')
+      stream.write(code_systems)
+    for vs in self.value_sets:
+      stream.write('\n\n')
+      vs.write_to(stream)
+
   # String representation of valuesets within a namespace
   def __str__(self):
-    header = self.build_header()
-    code_systems = self.build_codesystems()
-    value_sets = '\n\n'.join(self.value_sets)
-    output = [header, code_systems, value_sets]
-    return '\n\n'.join(filter(None, output))
+    output = io.StringIO()
+    self.write_to(output)
+    return output.getvalue()
+
+
+# Looks up the codesystems building a value set would, in the same order,
+# without building it
+def look_up_value_set(value_set: dict) -> None:
+  for concept in value_set.get('concepts', []):
+    CodeSystems.get(concept.get('system', ''))
+  for child in value_set.get('children', []):
+    in_code = Value.system_in_code.get(child['type'])
+    if in_code is None:
+      Value(child)
+    elif in_code:
+      CodeSystems.get(child.get('code', {}).get('system', ''))
+    else:
+      CodeSystems.get(child.get('system', ''))
 
 
 # Manages all namespace valuesets
 class ValueSets:
 
-  def __init__(self, value_sets: dict):
+  def __init__(self, value_sets: dict, select: Selection=None):
     self.value_sets = dict()
+    self.select = select
     self.parse_children(value_sets.get('children', []))
 
-  # Parses children and joins children with the same namespace
+  # Parses children and joins children with the same namespace. Value sets
+  # of namespaces that aren't selected only have their codesystems looked
+  # up, so abbreviations match converting everything.
   def parse_children(self, children: list) -> None:
     for child in children:
-      vs = ValueSet(child)
-      if vs.namespace in self.value_sets:
-        self.value_sets[vs.namespace].add(vs)
+      if is_selected(child.get('namespace', ''), self.select):
+        self.add(ValueSet(child))
       else:
-        self.value_sets[vs.namespace] = ValueSetNamespace(vs)
+        look_up_value_set(child)
+
+  # Adds a value set to the namespace it belongs to
+  def add(self, vs: ValueSet) -> None:
+    if vs.namespace in self.value_sets:
+      self.value_sets[vs.namespace].add(vs)
+    else:
+      self.value_sets[vs.namespace] = ValueSetNamespace(vs)